@@ -0,0 +1,81 @@
+# Copyright 2013-2015 Robert Jordens <jordens@gmail.com>
+#
+# This file is part of pdq2.
+#
+# pdq2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pdq2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pdq2.  If not, see <http://www.gnu.org/licenses/>.
+
+from .pdq2 import Pdq2
+
+
+class AsyncPdq2(Pdq2):
+    """PDQ stack with an asyncio interface.
+
+    Same as :class:`host.pdq2.Pdq2` but the methods that write to the
+    device (:meth:`cmd`, :meth:`write_mem`, :meth:`write_channel`,
+    :meth:`program`, :meth:`update_frame`, :meth:`remove_frame`,
+    :meth:`compact`, :meth:`load_image`) are coroutines.
+
+    Data is written in chunks and the writer is drained after each chunk.
+    This applies back-pressure from the transport and bounds the amount of
+    buffered data.
+
+    Args:
+        writer (asyncio.StreamWriter): Writer to use as device. Any object
+            with a non-blocking ``write()`` method and a ``drain()``
+            coroutine can be used, e.g. an in-memory fake device.
+        **kwargs: Passed to :class:`host.pdq2.Pdq2`.
+    """
+    def __init__(self, writer, **kwargs):
+        Pdq2.__init__(self, dev=writer, **kwargs)
+
+    @classmethod
+    async def connect(cls, url, **kwargs):
+        """Open a serial device and create a stack on it.
+
+        Requires the ``pyserial-asyncio`` package.
+
+        Args:
+            url (str): Pyserial device URL. See :class:`host.pdq2.Pdq2`.
+            **kwargs: Passed to :class:`AsyncPdq2`.
+
+        Returns:
+            :class:`AsyncPdq2`
+        """
+        import serial_asyncio
+        reader, writer = await serial_asyncio.open_serial_connection(url=url)
+        return cls(writer, **kwargs)
+
+    async def close(self):
+        """Close the device handle."""
+        self.dev.close()
+        wait_closed = getattr(self.dev, "wait_closed", None)
+        if wait_closed is not None:
+            await wait_closed()
+        del self.dev
+
+    async def _send(self, chunks):
+        for chunk in chunks:
+            # transports may hold on to the data until it is sent but the
+            # escaped chunks are only valid until the next one
+            self.write(bytes(chunk))
+            await self.dev.drain()
+
+    def program(self, program, channels=None):
+        """Serialize a wavesynth program and write it to the channels
+        in the stack.
+
+        See :meth:`host.pdq2.Pdq2.program`. Pipelining is not supported.
+        The channels are compiled before writing starts.
+        """
+        return Pdq2.program(self, program, channels)
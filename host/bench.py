@@ -0,0 +1,244 @@
+#!/usr/bin/python
+# Copyright 2013-2015 Robert Jordens <jordens@gmail.com>
+#
+# This file is part of pdq2.
+#
+# pdq2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pdq2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pdq2.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Benchmarks of the host compile and upload paths.
+
+Run as ``python3 -m host.bench``. The results are printed and can be saved
+as JSON to track performance between versions.
+"""
+
+import argparse
+import json
+import platform
+import time
+import tracemalloc
+
+import numpy as np
+
+from .pdq2 import Pdq2, Segment, discrete_compensate
+
+
+class Sink:
+    """In-memory device that discards all data."""
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        return len(data)
+
+
+def synthetic_program(lines=30, frames=8, channels=3, order=3,
+                      target="bias", seed=0):
+    """Generate a random wavesynth program.
+
+    Args:
+        lines (int): Number of lines per frame.
+        frames (int): Number of frames.
+        channels (int): Number of channels.
+        order (int): Spline order (``0`` to ``3``) of the amplitudes.
+        target (str): ``"bias"`` or ``"dds"``. DDS lines have cubic
+            amplitudes and ``order`` phase coefficients.
+        seed (int): Random seed.
+
+    Returns:
+        program (list): Wavesynth program.
+    """
+    rng = np.random.RandomState(seed)
+    program = []
+    for i in range(frames):
+        duration = rng.randint(100, 1000, lines)
+        amplitude = rng.uniform(-1, 1, (lines, channels, 4))
+        amplitude[:, :, 1:] *= 10.**-(4*np.arange(1, 4))
+        phase = rng.uniform(0, .5, (lines, channels, 3))
+        phase[:, :, 1:] *= 1e-4
+        frame = []
+        for j in range(lines):
+            channel_data = []
+            for k in range(channels):
+                if target == "dds":
+                    data = {"amplitude": amplitude[j, k].tolist()}
+                    if order:
+                        data["phase"] = phase[j, k, :order].tolist()
+                else:
+                    data = {"amplitude": amplitude[j, k, :order + 1].tolist()}
+                channel_data.append({target: data})
+            frame.append({"duration": int(duration[j]),
+                          "channel_data": channel_data})
+        program.append(frame)
+    return program
+
+
+def measure(func, repeat=3):
+    """Time a function and determine its peak memory allocation.
+
+    Args:
+        func (callable): Function to benchmark. Called without arguments.
+        repeat (int): Number of timed calls. The fastest is reported.
+
+    Returns:
+        time (float): Duration of the fastest call in seconds.
+        peak_memory (int): Peak memory allocated during an additional call
+            in bytes.
+    """
+    times = []
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return min(times), peak
+
+
+def _coefficients(program, target):
+    # scaled and compensated coefficients of all lines of all channels
+    coefs = []
+    for frame in program:
+        for line in frame:
+            for data in line["channel_data"]:
+                data = data[target]
+                scale = Segment.out_scale
+                if target == "dds":
+                    scale /= Segment.cordic_gain
+                coef = [scale*a for a in data["amplitude"]]
+                discrete_compensate(coef)
+                coef += [p*Segment.max_val*2 for p in data.get("phase", [])]
+                coefs.append((line["duration"], coef))
+    return coefs
+
+
+def run(lines=30, frames=8, channels=3, order=3, target="bias",
+        repeat=3):
+    """Run all benchmarks.
+
+    See :func:`synthetic_program` for the arguments. The program must fit
+    into the channel memory (see :meth:`host.pdq2.Pdq2.budget`).
+
+    Returns:
+        results (dict): Mapping of benchmark name to a dictionary of
+            ``time`` (s), ``lines``, ``bytes``, ``lines_per_s``,
+            ``bytes_per_s`` and ``peak_memory`` (bytes).
+    """
+    program = synthetic_program(lines, frames, channels, order, target)
+    num_boards = -(-channels//3)
+    n = frames*lines*channels
+    widths = [0, 1, 2, 2, 0, 1, 1]
+    coefs = _coefficients(program, target)
+    packed = [(duration, Segment.pack(widths, coef))
+              for duration, coef in coefs]
+    typ = 1 if target == "dds" else 0
+
+    def pack():
+        for duration, coef in coefs:
+            Segment.pack(widths, coef)
+
+    def line():
+        segment = Segment()
+        for duration, data in packed:
+            segment.line(typ, duration, data)
+
+    pdq = Pdq2(dev=Sink(), num_boards=num_boards)
+    images = [image for channel, image in pdq.compile(program,
+                                                       range(channels))]
+    image_bytes = sum(len(image) for image in images)
+
+    def serialize():
+        for ch in pdq.channels[:channels]:
+            ch.serialize()
+
+    def write_mem():
+        for i, image in enumerate(images):
+            pdq.write_mem(i, image)
+
+    def program_():
+        Pdq2(dev=Sink(), num_boards=num_boards).program(
+            program, range(channels))
+
+    benchmarks = [
+        ("pack", pack, sum(len(data) for duration, data in packed)),
+        ("line", line, sum(4 + len(data) for duration, data in packed)),
+        ("serialize", serialize, image_bytes),
+        ("write_mem", write_mem, image_bytes),
+        ("program", program_, image_bytes),
+    ]
+    results = {}
+    for name, func, size in benchmarks:
+        t, peak = measure(func, repeat)
+        results[name] = {
+            "time": t,
+            "lines": n,
+            "bytes": size,
+            "lines_per_s": n/t,
+            "bytes_per_s": size/t,
+            "peak_memory": peak,
+        }
+    return results
+
+
+def get_argparser():
+    parser = argparse.ArgumentParser(description="""PDQ2 host benchmarks.
+            Times compilation and upload of synthetic wavesynth
+            programs.""")
+    parser.add_argument("-l", "--lines", default=30, type=int,
+                        help="lines per frame [%(default)s]")
+    parser.add_argument("-f", "--frames", default=8, type=int,
+                        help="frames [%(default)s]")
+    parser.add_argument("-c", "--channels", default=3, type=int,
+                        help="channels [%(default)s]")
+    parser.add_argument("-k", "--order", default=3, type=int,
+                        help="spline order [%(default)s]")
+    parser.add_argument("-t", "--target", default="bias",
+                        choices=["bias", "dds"], help="target [%(default)s]")
+    parser.add_argument("-r", "--repeat", default=3, type=int,
+                        help="repetitions [%(default)s]")
+    parser.add_argument("-L", "--label", default="",
+                        help="label stored with the results, e.g. the "
+                        "version [%(default)s]")
+    parser.add_argument("-j", "--json", help="save results to file")
+    return parser
+
+
+def main():
+    args = get_argparser().parse_args()
+    params = dict(lines=args.lines, frames=args.frames,
+                  channels=args.channels, order=args.order,
+                  target=args.target)
+    results = run(repeat=args.repeat, **params)
+    for name, r in results.items():
+        print("{:10s} {:9.3g} s {:9.3g} lines/s {:9.3g} B/s "
+              "{:9.3g} B peak".format(name, r["time"], r["lines_per_s"],
+                                      r["bytes_per_s"], r["peak_memory"]))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "label": args.label,
+                "time": time.time(),
+                "python": platform.python_version(),
+                "numpy": np.__version__,
+                "params": params,
+                "results": results,
+            }, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
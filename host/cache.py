@@ -0,0 +1,390 @@
+# Copyright 2013-2015 Robert Jordens <jordens@gmail.com>
+#
+# This file is part of pdq2.
+#
+# pdq2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pdq2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pdq2.  If not, see <http://www.gnu.org/licenses/>.
+
+from collections import OrderedDict
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from .wavesynth import is_columnar
+
+
+#: Version of the compiled data format. Part of the persistent cache keys.
+FORMAT_VERSION = 1
+
+
+def write_atomic(path, data, prefix=".tmp-"):
+    """Write a file atomically.
+
+    The data is written to a temporary file in the same directory that then
+    replaces ``path``. Readers see either the old or the new file. The file
+    is created with mode ``0o666`` masked by the umask, like :func:`open`.
+
+    Args:
+        path (str): File name.
+        data (bytes): File contents.
+        prefix (str): Prefix of the temporary file name.
+    """
+    tmp = os.path.join(os.path.dirname(os.path.abspath(path)),
+                       prefix + os.urandom(8).hex())
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL |
+                 getattr(os, "O_BINARY", 0), 0o666)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def _jsonable(obj):
+    # numpy scalars and arrays
+    return obj.tolist()
+
+
+def canonical(obj):
+    """Canonical serialization of wavesynth data.
+
+    Args:
+        obj: JSON serializable wavesynth data. NumPy scalars and arrays are
+            accepted.
+
+    Returns:
+        data (bytes): Stable serialized representation of ``obj``.
+    """
+    return json.dumps(obj, sort_keys=True, separators=(",", ":"),
+                      default=_jsonable).encode()
+
+
+def frame_key(frame, index, *params):
+    """Content hash of the lines of one channel in a wavesynth frame.
+
+    Args:
+        frame (list): Wavesynth frame (list of lines) or columnar frame.
+        index (int): Index into the ``channel_data`` of each line or channel
+            index into the columnar frame.
+        *params: Additional compile parameters to include in the hash.
+
+    Returns:
+        key (str): Hex digest.
+    """
+    h = hashlib.sha1(canonical(params))
+    if is_columnar(frame):
+        if index < len(frame):
+            h.update(np.ascontiguousarray(frame[index]).tobytes())
+        return h.hexdigest()
+    for line in frame:
+        h.update(canonical([
+            line["duration"], line.get("dac_divider", 1),
+            line.get("trigger", False), _channel_data(line, index)]))
+    return h.hexdigest()
+
+
+def _channel_data(line, index):
+    # channels without data in a line only get the frame guard lines
+    data = line["channel_data"]
+    return data[index] if index < len(data) else None
+
+
+def _freeze(data):
+    # hashable copy of the channel data of a line
+    if data is None:
+        return None
+    return tuple(
+        (target, tuple(sorted(
+            (k, tuple(v) if isinstance(v, (list, tuple, np.ndarray)) else v)
+            for k, v in target_data.items())))
+        for target, target_data in data.items())
+
+
+def structural_key(frame, index, *params):
+    """Exact key of the lines of one channel in a wavesynth frame.
+
+    Cheaper to compute than :func:`frame_key` but only valid within a
+    process. Equal keys compare equal: there are no hash collisions.
+
+    Args:
+        frame (list): Wavesynth frame (list of lines) or columnar frame.
+        index (int): Index into the ``channel_data`` of each line or channel
+            index into the columnar frame.
+        *params: Additional compile parameters to include in the key.
+
+    Returns:
+        key (tuple): Hashable key.
+    """
+    if is_columnar(frame):
+        if index < len(frame):
+            return params, np.ascontiguousarray(frame[index]).tobytes()
+        return params, None
+    return params, tuple(
+        (line["duration"], line.get("dac_divider", 1),
+         line.get("trigger", False), _freeze(_channel_data(line, index)))
+        for line in frame)
+
+
+def program_key(program, *params):
+    """Content hash of a wavesynth program.
+
+    Args:
+        program (list): Wavesynth program (list of frames). Frames can be
+            in the columnar format.
+        *params: Additional compile parameters to include in the hash.
+
+    Returns:
+        key (str): Hex digest.
+    """
+    h = hashlib.sha1(canonical(params))
+    for frame in program:
+        if is_columnar(frame):
+            h.update(b"c")
+            for lines in frame:
+                h.update(canonical(len(lines)))
+                h.update(np.ascontiguousarray(lines).tobytes())
+        else:
+            h.update(b"d")
+            h.update(canonical(frame))
+    return h.hexdigest()
+
+
+class SegmentCache:
+    """In-process LRU cache of serialized segment data.
+
+    Args:
+        max_size (int): Maximum total size of the cached data in bytes.
+            The least recently used entries are evicted when it is exceeded.
+
+    Attributes:
+        size (int): Current total size of the cached data in bytes.
+        hits (int): Number of successful lookups.
+        misses (int): Number of failed lookups.
+        evictions (int): Number of evicted entries.
+    """
+    def __init__(self, max_size=1 << 24):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def key(self, frame, index, *params):
+        """See :func:`structural_key`."""
+        return structural_key(frame, index, *params)
+
+    def get(self, key):
+        """Look up segment data.
+
+        Args:
+            key (tuple): Cache key.
+
+        Returns:
+            data (bytes): Cached segment data or ``None``.
+        """
+        data = self._entries.get(key)
+        if data is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._entries.move_to_end(key)
+        return data
+
+    def put(self, key, data):
+        """Store segment data.
+
+        Args:
+            key (tuple): Cache key.
+            data (bytes): Segment data.
+        """
+        data = bytes(data)
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.size -= len(old)
+        if len(data) > self.max_size:
+            return
+        self._entries[key] = data
+        self.size += len(data)
+        while self.size > self.max_size:
+            key, old = self._entries.popitem(last=False)
+            self.size -= len(old)
+            self.evictions += 1
+
+    def clear(self):
+        """Remove all entries."""
+        self._entries.clear()
+        self.size = 0
+
+
+class DiskCache:
+    """Persistent cache of serialized channel memory images.
+
+    The entries are stored as files in a directory that can be shared
+    between processes. Entries are written atomically (written to a
+    temporary file and renamed) so that concurrent readers and writers
+    only ever see complete entries. The file modification time is
+    updated on access and the least recently used entries are evicted when
+    the total size exceeds ``max_size``.
+
+    The directory is only scanned when the size written since the last
+    scan exceeds ``max_size``. Entries are then evicted until the size is
+    below three quarters of ``max_size``.
+
+    Args:
+        path (str): Cache directory. Created if it does not exist.
+        max_size (int): Maximum total size of the cached data in bytes.
+
+    Attributes:
+        hits (int): Number of successful lookups by this process.
+        misses (int): Number of failed lookups by this process.
+        writes (int): Number of entries written by this process.
+        evictions (int): Number of entries evicted by this process.
+    """
+    def __init__(self, path, max_size=1 << 28):
+        self.path = path
+        self.max_size = max_size
+        os.makedirs(path, exist_ok=True)
+        # size of the entries as of the last scan plus the size written
+        self._size = None
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+    def key(self, program, index, *params):
+        """Cache key of a channel image.
+
+        Only the lines of the channel are hashed (see :func:`frame_key`) so
+        that changes on other channels do not invalidate the entry.
+
+        Args:
+            program (list): Wavesynth program (list of frames).
+            index (int): Index into the ``channel_data`` of each line or
+                channel index into the columnar frames.
+            *params: Compile parameters to include in the hash. Should
+                include :data:`FORMAT_VERSION`.
+
+        Returns:
+            key (str): Hex digest.
+        """
+        h = hashlib.sha1(canonical(params))
+        for frame in program:
+            h.update(frame_key(frame, index).encode())
+        return h.hexdigest()
+
+    def _file(self, key):
+        return os.path.join(self.path, key + ".bin")
+
+    def get(self, key):
+        """Look up a channel image.
+
+        Args:
+            key (str): Cache key.
+
+        Returns:
+            data (bytes): Cached channel image or ``None``.
+        """
+        name = self._file(key)
+        try:
+            with open(name, "rb") as f:
+                data = f.read()
+            os.utime(name)
+        except FileNotFoundError:
+            # also if evicted concurrently
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data
+
+    def put(self, key, data):
+        """Store a channel image.
+
+        Args:
+            key (str): Cache key.
+            data (bytes): Channel image.
+        """
+        if len(data) > self.max_size:
+            return
+        if self._size is None:
+            self._size = sum(entry[1] for entry in self._entries())
+        write_atomic(self._file(key), data)
+        self.writes += 1
+        self._size += len(data)
+        if self._size > self.max_size:
+            self._evict(self.max_size*3//4)
+
+    def _entries(self):
+        entries = []
+        with os.scandir(self.path) as it:
+            for entry in it:
+                if not entry.name.endswith(".bin"):
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime_ns, st.st_size, entry.path))
+        return entries
+
+    def _evict(self, max_size):
+        entries = self._entries()
+        size = sum(entry[1] for entry in entries)
+        entries.sort()
+        for mtime, length, name in entries:
+            if size <= max_size:
+                break
+            try:
+                os.unlink(name)
+                self.evictions += 1
+            except FileNotFoundError:
+                pass
+            size -= length
+        self._size = size
+
+    def __len__(self):
+        return len(self._entries())
+
+    def stats(self):
+        """Cache statistics.
+
+        Returns:
+            stats (dict): ``hits``, ``misses``, ``writes`` and
+                ``evictions`` of this process, and the number of
+                ``entries`` and their total ``size`` in bytes.
+        """
+        entries = self._entries()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "evictions": self.evictions,
+            "entries": len(entries),
+            "size": sum(entry[1] for entry in entries),
+        }
+
+    def clear(self):
+        """Remove all entries."""
+        for mtime, length, name in self._entries():
+            try:
+                os.unlink(name)
+            except FileNotFoundError:
+                pass
+        self._size = None
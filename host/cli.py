@@ -18,11 +18,13 @@
 
 import logging
 import numpy as np
-from scipy import interpolate
 
 from .pdq2 import Pdq2
+from .fit import fit, fit_adaptive
+from . import image
 
 import argparse
+from io import BytesIO
 import time
 
 
@@ -44,6 +46,9 @@ def get_argparser():
     parser.add_argument("-o", "--order", default=3, type=int,
                         help="interpolation (0: const, 1: lin, 2: quad,"
                         " 3: cubic) [%(default)s]")
+    parser.add_argument("-a", "--tolerance", type=float,
+                        help="place few lines with this maximum error (V) "
+                        "instead of one line per sample [%(default)s]")
     parser.add_argument("-u", "--dump", help="dump to file [%(default)s]")
     parser.add_argument("-r", "--reset", default=False,
                         action="store_true", help="do reset before")
@@ -55,6 +60,12 @@ def get_argparser():
                         help="software trigger [%(default)s]")
     parser.add_argument("-d", "--debug", default=False,
                         action="store_true", help="debug communications")
+    parser.add_argument("--compile-only", metavar="IMAGE",
+                        help="compile to a stack image file and exit "
+                        "without communicating [%(default)s]")
+    parser.add_argument("--load", metavar="IMAGE",
+                        help="upload a stack image file instead of "
+                        "compiling [%(default)s]")
     return parser
 
 
@@ -65,6 +76,11 @@ def main(dev=None):
     time/voltage data using a spline, generate a wavesynth program from the
     data and upload it to the specified channel. Then perform the desired
     arming/triggering/starting functions on the stack.
+
+    With ``--compile-only``, the program is compiled into a stack image
+    file (see :mod:`host.image`) and nothing is written to the stack.
+    With ``--load``, a stack image file is uploaded instead of the
+    program.
     """
     parser = get_argparser()
     args = parser.parse_args()
@@ -74,51 +90,73 @@ def main(dev=None):
     else:
         logging.basicConfig(level=logging.WARNING)
 
-    if args.dump:
+    if args.compile_only:
+        dev = BytesIO()
+    elif args.dump:
         dev = open(args.dump, "wb")
     dev = Pdq2(args.serial, dev)
 
+    freq = 50e6
+    if args.multiplier:
+        freq *= 2
+
+    if args.compile_only:
+        program = get_program(args, freq, dev.channels[args.channel])
+        image.save(args.compile_only,
+                   image.compile_image(dev, program, [args.channel]))
+        return
+
     if args.reset:
         dev.write(b"\x00\x00")  # flush any escape
         dev.cmd("RESET", True)
         time.sleep(.1)
 
     dev.cmd("DCM", args.multiplier)
-    freq = 50e6
-    if args.multiplier:
-        freq *= 2
-
-    times = np.around(eval(args.times, globals(), {})*freq)
-    voltages = eval(args.voltages, globals(), dict(t=times/freq))
-
     dev.cmd("START", False)
     dev.cmd("ARM", True)
     dev.cmd("TRIGGER", True)
 
-    dt = np.diff(times.astype(np.int))
-    if args.order:
-        tck = interpolate.splrep(times, voltages, k=args.order, s=0)
-        u = interpolate.spalde(times, tck)
+    if args.load:
+        with image.StackImage.open(args.load) as img:
+            dev.load_image(img)
     else:
-        u = voltages[:, None]
-    segment = []
-    for dti, ui in zip(dt, u):
-        segment.append({
-            "duration": int(dti),
-            "channel_data": [{
-                "bias": {
-                    "amplitude": [float(uij) for uij in ui]
-                }
-            }]
-        })
-    program = [[] for i in range(dev.channels[args.channel].num_frames)]
-    program[args.frame] = segment
-    dev.program(program, [args.channel])
+        program = get_program(args, freq, dev.channels[args.channel])
+        dev.program(program, [args.channel])
 
     dev.cmd("TRIGGER", args.free)
     dev.cmd("ARM", not args.disarm)
     dev.cmd("START", True)
 
 
+def get_program(args, freq, channel):
+    """Interpolate the time/voltage data and generate a wavesynth program
+    for a single channel.
+
+    The frame is generated in the columnar format (see :func:`host.fit.fit`
+    and :func:`host.fit.fit_adaptive`).
+
+    Args:
+        args (argparse.Namespace): Parsed command line arguments.
+        freq (float): Clock frequency.
+        channel (Channel): Channel to generate the program for.
+
+    Returns:
+        program (list): Wavesynth program.
+    """
+    times = np.around(eval(args.times, globals(), {})*freq)
+    voltages = eval(args.voltages, globals(), dict(t=times/freq))
+    if args.tolerance:
+        segment, stats = fit_adaptive(times, voltages, args.tolerance,
+                                      args.order)
+        for stat in stats:
+            logging.info("%(lines)s lines, %(words)s words, compression "
+                         "%(compression).3g, error %(error).3g V", stat)
+    else:
+        segment = fit(times, voltages, args.order)
+    program = [[] for i in range(channel.num_frames)]
+    program[args.frame] = segment
+    return program
+
+
 if __name__ == "__main__":
     main()
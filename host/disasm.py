@@ -0,0 +1,423 @@
+#!/usr/bin/python
+# Copyright 2013-2015 Robert Jordens <jordens@gmail.com>
+#
+# This file is part of pdq2.
+#
+# pdq2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pdq2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pdq2.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Disassembler for PDQ2 byte streams and channel memory images.
+
+The byte stream written to a stack (e.g. by ``host.cli --dump``) is
+unescaped and split into commands and memory writes. The channel memories
+are rebuilt from the writes and their frame tables and lines are decoded
+into structured arrays. :func:`error_bound` and :func:`check` determine
+the error caused by the fixed point representation of the lines.
+
+Run as ``python3 -m host.disasm DUMP`` to print a summary of a dump.
+"""
+
+import argparse
+
+import numpy as np
+
+from .escape import unescape
+from .pdq2 import Channel, Pdq2, Segment
+
+
+#: Memory writes as returned by :func:`parse`.
+#:
+#: * ``board``, ``dac``: Target of the write.
+#: * ``start``, ``end``: First and last (inclusive) word address.
+#: * ``offset``: Word offset of the data in the data stream.
+#: * ``length``: Number of data words received. Can be smaller than
+#:   ``end - start + 1`` if the write was truncated.
+write_dtype = np.dtype([
+    ("board", "u1"),
+    ("dac", "u1"),
+    ("start", "<u2"),
+    ("end", "<u2"),
+    ("offset", "<i8"),
+    ("length", "<i8"),
+])
+
+#: Decoded lines as returned by :func:`decode_lines`.
+#:
+#: * ``frame``: Frame index or ``-1``.
+#: * ``addr``: Word address of the line header.
+#: * ``length`` ... ``wait``: Header fields, see
+#:   :data:`gateware.dac.line_layout`.
+#: * ``duration``: Duration (``dt``).
+#: * ``data``: Raw data words, zero-padded.
+#: * ``coef``: Fixed point coefficients as floats, in units of DAC LSB (or
+#:   phase LSB) and powers of ``1/(2**shift*clock_period)``.
+#: * ``amplitude``: Amplitude coefficients in Volts with the discrete time
+#:   and CORDIC gain compensation undone (see :meth:`host.pdq2.Segment.bias`
+#:   and :meth:`host.pdq2.Segment.dds`).
+#: * ``amplitude_len``: Number of amplitude coefficients.
+#: * ``phase``: Phase coefficients in turns.
+#: * ``phase_len``: Number of phase coefficients.
+line_dtype = np.dtype([
+    ("frame", "i1"),
+    ("addr", "<u2"),
+    ("length", "u1"),
+    ("typ", "u1"),
+    ("trigger", "?"),
+    ("silence", "?"),
+    ("aux", "?"),
+    ("shift", "u1"),
+    ("end", "?"),
+    ("clear", "?"),
+    ("wait", "?"),
+    ("duration", "<u2"),
+    ("data", "<u2", (14,)),
+    ("coef", "<f8", (7,)),
+    ("amplitude", "<f8", (4,)),
+    ("amplitude_len", "u1"),
+    ("phase", "<f8", (3,)),
+    ("phase_len", "u1"),
+])
+
+_widths = [0, 1, 2, 2, 0, 1, 1]
+_reset = Pdq2._commands.index("RESET") << 1
+
+
+def parse(stream):
+    """Split a byte stream into commands and memory writes.
+
+    A ``RESET`` command restarts the memory write protocol.
+
+    Args:
+        stream (bytes): Escaped byte stream as written to the stack.
+
+    Returns:
+        words (array[uint16]): Data stream words.
+        commands (list[tuple[int, str, bool]]): Word offset in the data
+            stream, name and enable flag of each command.
+        writes (array[write_dtype]): Memory writes.
+    """
+    data, codes = unescape(stream, Pdq2._escape[0])
+    commands = []
+    breaks = [0]
+    for offset, code in codes.tolist():
+        commands.append((offset//2, Pdq2._commands[code >> 1],
+                         not code & 1))
+        if code == _reset:
+            breaks.append(offset)
+    breaks.append(len(data))
+    words = []
+    writes = []
+    base = 0
+    for start, stop in zip(breaks, breaks[1:]):
+        piece = data[start:stop]
+        piece = np.frombuffer(piece[:len(piece) & ~1], "<u2")
+        words.append(piece)
+        pos = 0
+        n = len(piece)
+        while pos + 3 <= n:
+            dev, first, last = piece[pos:pos + 3].tolist()
+            count = ((last - first) & 0xffff) + 1
+            length = min(count, n - pos - 3)
+            writes.append((dev >> 4, dev & 0xf, first, last, base + pos + 3,
+                           length))
+            pos += 3 + count
+        base += len(piece)
+    words = np.concatenate(words) if words else np.zeros(0, "<u2")
+    return words, commands, np.array(writes, write_dtype)
+
+
+def memories(words, writes, num_dacs=Pdq2.num_dacs, size=Channel.max_data):
+    """Rebuild the channel memories from memory writes.
+
+    Args:
+        words (array[uint16]): Data stream words.
+        writes (array[write_dtype]): Memory writes.
+        num_dacs (int): Number of DACs per board.
+        size (int): Channel memory size in words.
+
+    Returns:
+        memories (dict[int, array[uint16]]): Memory content of each written
+            channel. Unwritten words are zero.
+    """
+    mems = {}
+    for board, dac, start, end, offset, length in writes.tolist():
+        channel = board*num_dacs + dac
+        mem = mems.get(channel)
+        if mem is None:
+            mem = mems[channel] = np.zeros(size, "<u2")
+        length = min(length, size - start)
+        mem[start:start + length] = words[offset:offset + length]
+    return mems
+
+
+def unpack_array(widths, data):
+    """Unpack spline data.
+
+    Inverse of :meth:`host.pdq2.Segment.pack_array`.
+
+    Args:
+        widths (list[int]): Widths of values in multiples of 16 bits.
+        data (array[uint16]): Packed data. One row per line.
+
+    Returns:
+        values (array[float]): Values. One row per line.
+    """
+    data = np.asarray(data, np.int64)
+    values = np.empty((len(data), len(widths)))
+    i = 0
+    for j, width in enumerate(widths):
+        words = data[:, i:i + width + 1]
+        v = words[:, -1].astype(np.uint16).view(np.int16).astype(np.int64)
+        for k in range(width - 1, -1, -1):
+            v = (v << 16) | words[:, k]
+        values[:, j] = v*2.**(-16*width)
+        i += width + 1
+    return values
+
+
+def decode_lines(mem, addr, frame=-1):
+    """Decode lines.
+
+    Args:
+        mem (array[uint16]): Channel memory.
+        addr (array[int]): Addresses of the line headers.
+        frame (array[int]): Frame index of each line.
+
+    Returns:
+        lines (array[line_dtype]): Decoded lines.
+    """
+    mem = np.asarray(mem, np.uint16)
+    addr = np.asarray(addr, int)
+    w = np.r_[mem, np.zeros(16, np.uint16)][addr[:, None] + np.arange(16)]
+    header = w[:, 0].astype(int)
+    out = np.zeros(len(addr), line_dtype)
+    out["frame"] = frame
+    out["addr"] = addr
+    for name, shift, width in [
+            ("length", 0, 4), ("typ", 4, 2), ("trigger", 6, 1),
+            ("silence", 7, 1), ("aux", 8, 1), ("shift", 9, 4),
+            ("end", 13, 1), ("clear", 14, 1), ("wait", 15, 1)]:
+        out[name] = (header >> shift) & ((1 << width) - 1)
+    out["duration"] = w[:, 1]
+    nd = np.clip(out["length"].astype(int) - 1, 0, 14)
+    data = np.where(np.arange(14) < nd[:, None], w[:, 2:], 0)
+    out["data"] = data
+    coef = unpack_array(_widths, data)
+    out["coef"] = coef
+    dds = out["typ"] == 1
+    scale = np.where(dds, Segment.out_scale/Segment.cordic_gain,
+                     Segment.out_scale)
+    amplitude = coef[:, :4]/scale[:, None]
+    # undo discrete_compensate()
+    amplitude[:, 2] -= amplitude[:, 3]
+    amplitude[:, 1] -= amplitude[:, 2]/2 + amplitude[:, 3]/6
+    out["amplitude"] = amplitude
+    out["phase"] = coef[:, 4:]/(2*Segment.max_val)
+    out["amplitude_len"] = np.searchsorted(Segment._bias_words,
+                                           np.minimum(nd, 9))
+    out["phase_len"] = np.where(dds, np.searchsorted(
+        Segment._phase_words, np.clip(nd - 9, 0, 5)), 0)
+    return out
+
+
+def walk(mem, addr):
+    """Follow the lines of a frame.
+
+    Args:
+        mem (array[uint16]): Channel memory.
+        addr (int): Address of the first line.
+
+    Returns:
+        addr (list[int]): Addresses of the lines up to and including the
+            first line with the ``end`` flag.
+    """
+    mem = np.asarray(mem, np.uint16)
+    header = mem.tolist()
+    addrs = []
+    while addr < len(header) and len(addrs) < len(header):
+        addrs.append(addr)
+        if header[addr] & (1 << 13):
+            break
+        addr += 1 + (header[addr] & 0xf)
+    return addrs
+
+
+def disassemble(mem, num_frames=Channel.num_frames):
+    """Decode a channel memory image.
+
+    Args:
+        mem (bytes): Channel memory image (e.g. as returned by
+            :meth:`host.pdq2.Channel.serialize`) or array of words.
+        num_frames (int): Number of frames.
+
+    Returns:
+        table (array[uint16]): Frame address table.
+        lines (array[line_dtype]): Lines of all frames. Frames sharing a
+            segment are decoded for each of them.
+    """
+    if not isinstance(mem, np.ndarray):
+        mem = np.frombuffer(mem, "<u2")
+    table = mem[:num_frames]
+    addr = []
+    frame = []
+    for i, start in enumerate(table.tolist()):
+        if start:
+            a = walk(mem, start)
+            addr.extend(a)
+            frame.extend([i]*len(a))
+    return table, decode_lines(mem, np.array(addr, int), np.array(frame))
+
+
+#: Resolution of the stored amplitude offset and derivatives in DAC LSB.
+amplitude_resolution = np.array([1., 2.**-16, 2.**-32, 2.**-32])
+#: Resolution of the stored phase offset (turns), frequency
+#: (turns/clock_period) and chirp (turns/clock_period per step).
+phase_resolution = np.array([2.**-16, 2.**-32, 2.**-32])
+
+
+def error_bound(lines):
+    """Worst-case error of lines due to the fixed point coefficients.
+
+    Each stored coefficient deviates from the ideal one by up to half its
+    resolution. The accumulators propagate these deviations over the
+    duration of the line. The bound is the worst-case deviation between
+    the ideal spline and the accumulator evaluation at the end of the line.
+    The truncation of the accumulator to the DAC output adds up to one LSB
+    and is not included. The phase accumulator is not cleared between
+    lines so that phase errors of consecutive lines add.
+
+    The bound assumes that the amplitude accumulators do not overflow,
+    i.e. that the ideal spline stays within the DAC range and the output
+    does not wrap.
+
+    Args:
+        lines (array[line_dtype]): Decoded lines.
+
+    Returns:
+        amplitude (array[float]): Amplitude error bound in Volts (including
+            the CORDIC gain for DDS lines).
+        phase (array[float]): Phase error bound in turns.
+    """
+    steps = ((lines["duration"].astype(np.int64) - 1) & 0xffff) + 1
+    n = steps.astype(np.float64)
+    cycles = n*(1 << lines["shift"].astype(np.int64))
+    binom = np.array([np.ones_like(n), n, n*(n - 1)/2,
+                      n*(n - 1)*(n - 2)/6]).T
+    used = np.arange(4) < lines["amplitude_len"][:, None]
+    amplitude = .5*(used*binom*amplitude_resolution).sum(1)
+    dds = lines["typ"] == 1
+    amplitude *= np.where(dds, Segment.cordic_gain, 1.)/Segment.out_scale
+    amplitude[lines["typ"] > 1] = 0
+    growth = np.array([np.ones_like(n), cycles, cycles*(n - 1)/2]).T
+    used = np.arange(3) < np.where(dds, lines["phase_len"], 0)[:, None]
+    phase = .5*(used*growth*phase_resolution).sum(1)
+    return amplitude, phase
+
+
+def check(mem, tolerance, phase_tolerance=np.inf,
+          num_frames=Channel.num_frames):
+    """Find lines of a channel memory image with large rounding errors.
+
+    See :func:`error_bound`.
+
+    Args:
+        mem (bytes): Channel memory image or array of words.
+        tolerance (float): Maximum amplitude error in Volts.
+        phase_tolerance (float): Maximum phase error in turns.
+        num_frames (int): Number of frames.
+
+    Returns:
+        lines (array[line_dtype]): Lines exceeding either tolerance.
+        amplitude (array[float]): Their amplitude error bounds in Volts.
+        phase (array[float]): Their phase error bounds in turns.
+    """
+    table, lines = disassemble(mem, num_frames)
+    amplitude, phase = error_bound(lines)
+    bad = (amplitude > tolerance) | (phase > phase_tolerance)
+    return lines[bad], amplitude[bad], phase[bad]
+
+
+class Dump:
+    """Disassembled byte stream.
+
+    Args:
+        stream (bytes): Escaped byte stream as written to the stack.
+
+    Attributes:
+        words (array[uint16]): Data stream words.
+        commands (list[tuple[int, str, bool]]): Commands, see :func:`parse`.
+        writes (array[write_dtype]): Memory writes.
+        memories (dict[int, array[uint16]]): Channel memories, see
+            :func:`memories`.
+    """
+    def __init__(self, stream):
+        self.words, self.commands, self.writes = parse(stream)
+        self.memories = memories(self.words, self.writes)
+
+    def channel(self, channel):
+        """Decode a channel memory.
+
+        See :func:`disassemble`.
+        """
+        return disassemble(self.memories[channel])
+
+
+def get_argparser():
+    parser = argparse.ArgumentParser(description="""PDQ2 disassembler.
+            Decodes a dump of the byte stream written to a stack.""")
+    parser.add_argument("dump", help="dump file")
+    parser.add_argument("-l", "--lines", default=False, action="store_true",
+                        help="print lines [%(default)s]")
+    parser.add_argument("-e", "--tolerance", type=float,
+                        help="print lines with rounding errors above this "
+                        "amplitude error (V) [%(default)s]")
+    return parser
+
+
+def main():
+    args = get_argparser().parse_args()
+    with open(args.dump, "rb") as f:
+        dump = Dump(f.read())
+    for offset, name, enable in dump.commands:
+        print("@{}: {} {}".format(offset, name, enable))
+    print("{} memory writes, {} words".format(
+        len(dump.writes), dump.writes["length"].sum()))
+    for channel in sorted(dump.memories):
+        table, lines = dump.channel(channel)
+        print("channel {}: frame table {}, {} lines".format(
+            channel, table.tolist(), len(lines)))
+        if args.tolerance is not None:
+            bad, amplitude, phase = check(dump.memories[channel],
+                                          args.tolerance)
+            for line, a, p in zip(bad, amplitude, phase):
+                print("  {} @{}: dt={} shift={} error {:.3g} V "
+                      "{:.3g} turns".format(
+                          line["frame"], line["addr"], line["duration"],
+                          line["shift"], a, p))
+        if not args.lines:
+            continue
+        for line in lines:
+            print("  {frame} @{addr}: typ={typ} dt={duration} "
+                  "shift={shift} trigger={trigger} end={end} "
+                  "amplitude={amplitude} phase={phase}".format(
+                      frame=line["frame"], addr=line["addr"],
+                      typ=line["typ"], duration=line["duration"],
+                      shift=line["shift"], trigger=line["trigger"],
+                      end=line["end"],
+                      amplitude=line["amplitude"][
+                          :line["amplitude_len"]].tolist(),
+                      phase=line["phase"][:line["phase_len"]].tolist()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+# Copyright 2013-2015 Robert Jordens <jordens@gmail.com>
+#
+# This file is part of pdq2.
+#
+# pdq2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pdq2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pdq2.  If not, see <http://www.gnu.org/licenses/>.
+
+"""In-memory emulation of a PDQ2 stack.
+
+:class:`Emulator` is a file-like device that can be passed to
+:class:`host.pdq2.Pdq2` as ``dev``. It models the protocol handling of
+:class:`gateware.comm.Comm` on every board of the stack: the
+:class:`gateware.escape.Unescaper`, the 16 bit little-endian packing, the
+:class:`gateware.comm.MemWriter` memory write packets and the
+:class:`gateware.comm.Ctrl` commands. The byte stream can be split
+arbitrarily between writes.
+
+The channel output can be computed from the emulated memories with
+:func:`host.synth.synthesize`.
+"""
+
+import numpy as np
+
+from .escape import unescape
+
+
+class Board:
+    """State of one emulated board.
+
+    Args:
+        address (int): Board address (the inverted ``adr`` pads).
+        mem_depths (list[int]): Memory depths of the DAC channels in words.
+            Powers of two.
+
+    Attributes:
+        address (int): Board address.
+        mems (list[array[uint16]]): Channel memories.
+        arm (bool): Arm state (``ARM`` command).
+        start (bool): Start state (``START`` command).
+        soft_trigger (bool): Software trigger state (``TRIGGER`` command).
+        dcm_sel (bool): Clock doubler state (``DCM`` command).
+        resets (int): Number of ``RESET`` commands received.
+    """
+    def __init__(self, address, mem_depths):
+        self.address = address
+        self.mems = [np.zeros(depth, np.uint16) for depth in mem_depths]
+        self.resets = 0
+        self.reset()
+
+    def reset(self):
+        """Reset the control state. The memories keep their content."""
+        self.arm = False
+        self.start = False
+        self.soft_trigger = False
+        self.dcm_sel = False
+
+    def command(self, code):
+        """Execute a command.
+
+        Args:
+            code (int): Command byte. Unknown commands are ignored.
+        """
+        if code == 0x00:
+            self.resets += 1
+            self.reset()
+            return
+        name = {0x02: "soft_trigger", 0x04: "arm", 0x06: "dcm_sel",
+                0x08: "start"}.get(code & ~1)
+        if name is not None:
+            setattr(self, name, not code & 1)
+
+
+class Emulator:
+    """File-like emulation of a stack of PDQ2 boards.
+
+    All boards receive the same byte stream. Memory writes are executed by
+    the board addressed in the packet header, commands by all boards.
+
+    Args:
+        num_boards (int): Number of boards. Boards are addressed ``0`` to
+            ``num_boards - 1``.
+        mem_depths (list[int]): Memory depths of the DAC channels of each
+            board in words, see :class:`gateware.pdq2.Pdq2Base`.
+        escape (int): Escape character.
+
+    Attributes:
+        boards (list[Board]): Emulated boards.
+        commands (list[int]): Command bytes received.
+        bytes_written (int): Number of bytes received.
+        closed (bool): Whether :meth:`close` has been called.
+    """
+    _states = "DEV START END DATA".split()
+
+    def __init__(self, num_boards=3, mem_depths=(1 << 13, 1 << 13, 1 << 12),
+                 escape=0xa5):
+        self.boards = [Board(i, mem_depths) for i in range(num_boards)]
+        self.num_dacs = len(mem_depths)
+        # the dac index signal is truncated and the last memory is the
+        # default of the write enable Array
+        self._dac_mask = (1 << (self.num_dacs - 1).bit_length()) - 1
+        self.escape = escape
+        self.commands = []
+        self.bytes_written = 0
+        self.closed = False
+        self._prefix = False
+        self._reset_comm()
+
+    def _reset_comm(self):
+        # unescaper, packer and memory writer state
+        self._low = None
+        self._state = 0
+        self._dac = 0
+        self._board = None
+        self._adr = 0
+        self._count = 0
+
+    @property
+    def state(self):
+        """State of the :class:`gateware.comm.MemWriter` (``"DEV"``,
+        ``"START"``, ``"END"`` or ``"DATA"``)."""
+        return self._states[self._state]
+
+    def memory(self, channel):
+        """Memory of a channel.
+
+        Args:
+            channel (int): Channel index. Assumes every board has
+                :attr:`num_dacs` channels.
+
+        Returns:
+            mem (array[uint16]): Channel memory. Not a copy.
+        """
+        board, dac = divmod(channel, self.num_dacs)
+        return self.boards[board].mems[dac]
+
+    def write(self, data):
+        """Receive data.
+
+        Args:
+            data (bytes): Escaped byte stream.
+
+        Returns:
+            written (int): Number of bytes consumed (``len(data)``).
+        """
+        if self.closed:
+            raise ValueError("write to closed device")
+        buf = np.frombuffer(data, np.uint8)
+        n = len(buf)
+        self.bytes_written += n
+        if self._prefix:
+            buf = np.r_[np.uint8(self.escape), buf]
+        # hold back a trailing escape prefix until the next write
+        esc = np.flatnonzero(buf != self.escape)
+        run = len(buf) - 1 - (esc[-1] if len(esc) else -1)
+        self._prefix = bool(run % 2)
+        if self._prefix:
+            buf = buf[:-1]
+        data, commands = unescape(buf, self.escape)
+        pos = 0
+        for offset, code in commands.tolist():
+            self._data(data[pos:offset])
+            pos = offset
+            self._command(code)
+        self._data(data[pos:])
+        return n
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def _command(self, code):
+        self.commands.append(code)
+        for board in self.boards:
+            board.command(code)
+        if code == 0x00:
+            self._reset_comm()
+
+    def _data(self, data):
+        if not len(data):
+            return
+        if self._low is not None:
+            data = np.r_[self._low, data]
+            self._low = None
+        if len(data) & 1:
+            self._low = data[-1]
+            data = data[:-1]
+        words = data.view("<u2")
+        pos = 0
+        while pos < len(words):
+            if self._state == 3:
+                pos += self._write(words[pos:pos + self._count])
+                continue
+            word = int(words[pos])
+            pos += 1
+            if self._state == 0:
+                self._dac = min(word & self._dac_mask, self.num_dacs - 1)
+                board = (word >> 4) & 0xf
+                self._board = (self.boards[board]
+                               if board < len(self.boards) else None)
+            elif self._state == 1:
+                self._adr = word
+            else:
+                self._count = ((word - self._adr) & 0xffff) + 1
+            self._state += 1
+
+    def _write(self, words):
+        n = len(words)
+        if self._board is not None:
+            mem = self._board.mems[self._dac]
+            adr = self._adr % len(mem)
+            if self._adr + n <= 1 << 16 and adr + n <= len(mem):
+                mem[adr:adr + n] = words
+            else:
+                adr = ((self._adr + np.arange(n)) & 0xffff) % len(mem)
+                mem[adr] = words
+        self._adr = (self._adr + n) & 0xffff
+        self._count -= n
+        if not self._count:
+            self._state = 0
+        return n
@@ -0,0 +1,126 @@
+# Copyright 2013-2015 Robert Jordens <jordens@gmail.com>
+#
+# This file is part of pdq2.
+#
+# pdq2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pdq2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pdq2.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+
+
+class Escaper:
+    """Streaming escape encoder.
+
+    The host side counterpart of :class:`gateware.escape.Unescaper` for the
+    data stream: every occurrence of the escape character is doubled.
+
+    The input is encoded in chunks of fixed size into a reusable output
+    buffer. Chunks without escape characters are passed through without
+    copying.
+
+    Args:
+        escape (int): Escape character.
+        chunk_size (int): Number of input bytes per chunk.
+    """
+    def __init__(self, escape=0xa5, chunk_size=1 << 16):
+        self.escape = escape
+        self.chunk_size = chunk_size
+        self._buf = np.empty(2*chunk_size, np.uint8)
+
+    def size(self, data):
+        """Size of the escaped data.
+
+        Args:
+            data (bytes): Data to escape.
+
+        Returns:
+            size (int): Length of the escaped data in bytes.
+        """
+        data = np.frombuffer(data, np.uint8)
+        return len(data) + np.count_nonzero(data == self.escape)
+
+    def encode(self, data):
+        """Escape data.
+
+        Args:
+            data (bytes): Data to escape.
+
+        Yields:
+            chunk (memoryview): Escaped chunk of data. The chunk is only
+                valid until the next chunk is requested.
+        """
+        data = np.frombuffer(data, np.uint8)
+        for i in range(0, len(data), self.chunk_size):
+            chunk = data[i:i + self.chunk_size]
+            escapes = chunk == self.escape
+            n = np.count_nonzero(escapes)
+            if not n:
+                yield memoryview(chunk)
+                continue
+            dest = np.arange(len(chunk)) + np.cumsum(escapes)
+            out = self._buf[:len(chunk) + n]
+            out[dest] = chunk
+            out[dest[escapes] - 1] = self.escape
+            yield memoryview(out)
+
+    def __call__(self, data):
+        """Escape data.
+
+        Args:
+            data (bytes): Data to escape.
+
+        Returns:
+            data (bytes): Escaped data.
+        """
+        return b"".join(bytes(chunk) for chunk in self.encode(data))
+
+
+#: Escaped commands as returned by :func:`unescape`.
+#:
+#: * ``offset``: Number of data bytes preceding the command.
+#: * ``code``: Command byte.
+command_dtype = np.dtype([("offset", "<i8"), ("code", "u1")])
+
+
+def unescape(data, escape=0xa5):
+    """Split an escaped stream into data and commands.
+
+    The inverse of :class:`Escaper` and the host side model of
+    :class:`gateware.escape.Unescaper`: a doubled escape character is a
+    literal escape character in the data, an escape character followed by
+    any other byte is a command.
+
+    Args:
+        data (bytes): Escaped stream.
+        escape (int): Escape character.
+
+    Returns:
+        data (array[uint8]): Unescaped data.
+        commands (array[command_dtype]): Commands and their positions in
+            the data.
+    """
+    data = np.frombuffer(data, np.uint8)
+    esc = data == escape
+    idx = np.arange(len(data))
+    start = esc.copy()
+    start[1:] &= ~esc[:-1]
+    # position within runs of escape characters, even ones are prefixes
+    run = idx - np.maximum.accumulate(np.where(start, idx, 0))
+    prefix = esc & (run % 2 == 0)
+    command = np.zeros_like(esc)
+    command[1:] = prefix[:-1] & ~esc[1:]
+    keep = ~(prefix | command)
+    commands = np.empty(np.count_nonzero(command), command_dtype)
+    commands["offset"] = (np.cumsum(keep) - keep)[command]
+    commands["code"] = data[command]
+    return data[keep], commands
@@ -0,0 +1,256 @@
+# Copyright 2013-2015 Robert Jordens <jordens@gmail.com>
+#
+# This file is part of pdq2.
+#
+# pdq2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pdq2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pdq2.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Spline fitting of sampled waveforms.
+
+:func:`fit` interpolates the samples of many channels at once with one line
+per sample interval. :func:`fit_adaptive` places few lines such that the
+output stays within a given error. The lines are returned as columnar
+frames (see :mod:`host.wavesynth`) that are packed by
+:meth:`host.pdq2.Segment.extend` without building line dictionaries.
+"""
+
+from math import factorial
+
+import numpy as np
+from scipy import interpolate
+
+from .pdq2 import Segment, discrete_compensate, frame_words
+from .synth import spline
+from .wavesynth import line_dtype
+
+
+def derivatives(times, voltages, order=3):
+    """Interpolate sampled waveforms and evaluate the spline derivatives.
+
+    The interpolating spline (with not-a-knot boundary conditions for
+    ``order > 1``) is the same as the one determined by
+    :func:`scipy.interpolate.splrep` with ``s=0``.
+
+    Args:
+        times (array[int]): Sample times in clock cycles. Shape
+            ``(samples,)`` if shared by all channels or ``(channels,
+            samples)``.
+        voltages (array[float]): Sample voltages in Volts. Shape
+            ``(channels, samples)``.
+        order (int): Spline order (``0`` to ``3``).
+
+    Returns:
+        derivatives (array[float]): Value and derivatives of the spline at
+            the start of each interval between samples, in Volts and
+            increasing powers of ``1/clock_period``. Shape ``(channels,
+            samples - 1, order + 1)``.
+    """
+    voltages = np.atleast_2d(np.asarray(voltages, np.float64))
+    times = np.asarray(times, np.float64)
+    if not 0 <= order <= 3:
+        raise ValueError("Only splines up to cubic order are supported.")
+    if times.ndim == 2 and np.all(times == times[:1]):
+        times = times[0]
+    if times.ndim == 2:
+        return np.array([derivatives(t, v, order)[0]
+                         for t, v in zip(times, voltages)])
+    if not order:
+        return voltages[:, :-1, None].copy()
+    spline = interpolate.make_interp_spline(times, voltages, k=order,
+                                            axis=1)
+    out = np.empty(voltages.shape[:1] + (len(times) - 1, order + 1))
+    for i in range(order + 1):
+        out[:, :, i] = spline(times[:-1], nu=i)
+    return out
+
+
+def fit(times, voltages, order=3):
+    """Fit sampled waveforms with bias lines.
+
+    Each interval between two samples becomes one line.
+
+    Args:
+        times (array[int]): Sample times in clock cycles, see
+            :func:`derivatives`.
+        voltages (array[float]): Sample voltages in Volts. Shape
+            ``(channels, samples)``.
+        order (int): Spline order (``0`` to ``3``).
+
+    Returns:
+        frame (array[line_dtype]): Columnar frame with shape ``(channels,
+            samples - 1)``.
+    """
+    times = np.asarray(times)
+    duration = np.diff(np.rint(times).astype(np.int64))
+    if np.any((duration <= 0) | (duration >= 1 << 16)):
+        raise ValueError("duration out of range")
+    amplitude = derivatives(times, voltages, order)
+    frame = np.zeros(amplitude.shape[:2], line_dtype)
+    frame["duration"] = duration
+    frame["amplitude_len"] = order + 1
+    frame["amplitude"][:, :, :order + 1] = amplitude
+    return frame
+
+
+def _polyfit(x, y, order):
+    # least squares polynomial in local time as value and derivatives
+    deg = min(order, len(x) - 1)
+    scale = max(float(x[-1]), 1.)
+    c = np.polynomial.polynomial.polyfit(x/scale, y, deg)
+    amplitude = np.zeros(order + 1)
+    for k in range(deg + 1):
+        amplitude[k] = c[k]*factorial(k)/scale**k
+    return amplitude
+
+
+def evaluate(amplitude, steps):
+    """Evaluate a bias line as the gateware does.
+
+    The line is packed like :meth:`host.pdq2.Segment.bias` and evaluated
+    with the fixed point :class:`gateware.dac.Volt` accumulator arithmetic
+    (see :func:`host.synth.spline`).
+
+    Args:
+        amplitude (list[float]): Amplitude coefficients, see
+            :meth:`host.pdq2.Segment.bias`.
+        steps (array[int]): Accumulator steps since the start of the line.
+
+    Returns:
+        voltage (array[float]): Output voltage in Volts.
+    """
+    coef = Segment.out_scale*np.array(amplitude, np.float64)[None]
+    discrete_compensate(coef.T)
+    data = Segment.pack_array([0, 1, 2, 2], coef)
+    return spline(data, steps)/Segment.out_scale
+
+
+def _error(x, y, amplitude):
+    try:
+        return np.fabs(evaluate(amplitude, x) - y).max()
+    except ValueError:  # coefficients out of range
+        return np.inf
+
+
+def _place(times, voltages, tolerance, order):
+    # greedy placement of the longest lines within the tolerance
+    n = len(times)
+    lines = []
+    error = 0.
+    start, span = 0, 1
+
+    def fits(span):
+        x = times[start:start + span + 1] - times[start]
+        if x[-1] >= 1 << 16:
+            return False
+        y = voltages[start:start + span + 1]
+        return _error(x[:-1], y[:-1], _polyfit(x, y, order)) <= tolerance
+
+    while start < n - 1:
+        limit = n - 1 - start
+        # gallop up from the previous span, then bisect
+        good, bad = 0, limit + 1
+        span = min(span, limit)
+        while fits(span):
+            good = span
+            if span == limit:
+                break
+            span = min(2*span, limit)
+        else:
+            bad = span
+        while bad - good > 1:
+            mid = (good + bad)//2
+            if fits(mid):
+                good = mid
+            else:
+                bad = mid
+        span = max(good, 1)
+        x = times[start:start + span + 1] - times[start]
+        y = voltages[start:start + span + 1]
+        # use the fewest coefficients that meet the tolerance
+        for k in range(order + 1):
+            amplitude = _polyfit(x, y, k)
+            e = _error(x[:-1], y[:-1], amplitude)
+            if e <= tolerance:
+                break
+        else:
+            if span == 1:
+                # hold the only sample covered
+                amplitude = y[:1]
+                e = _error(x[:1], y[:1], amplitude)
+        error = max(error, e)
+        lines.append((int(x[-1]), amplitude))
+        start += span
+    frame = np.zeros(len(lines), line_dtype)
+    for row, (duration, amplitude) in zip(frame, lines):
+        row["duration"] = duration
+        row["amplitude_len"] = len(amplitude)
+        row["amplitude"][:len(amplitude)] = amplitude
+    return frame, error
+
+
+def fit_adaptive(times, voltages, tolerance, order=3):
+    """Fit sampled waveforms with few bias lines.
+
+    Lines are placed greedily: each line is the longest that starts at the
+    end of the previous line and whose least squares polynomial fit, as
+    evaluated by the gateware (see :func:`evaluate`), stays within the
+    tolerance at all samples it covers. Each line then uses the fewest
+    coefficients that meet the tolerance. A line covering a single sample
+    interval holds the sample if no fit meets the tolerance. Its error is
+    then only due to the DAC resolution. Sample intervals must be shorter
+    than ``2**16`` clock cycles.
+
+    Args:
+        times (array[int]): Sample times in clock cycles, see
+            :func:`derivatives`.
+        voltages (array[float]): Sample voltages in Volts. Shape
+            ``(channels, samples)``.
+        tolerance (float): Maximum absolute error in Volts.
+        order (int): Maximum spline order (``0`` to ``3``).
+
+    Returns:
+        frame (list[array[line_dtype]]): Columnar frame. The channels
+            generally have different numbers of lines.
+        stats (list[dict]): For each channel: number of ``samples`` and
+            ``lines``, memory ``words`` used by the frame (see
+            :func:`host.pdq2.frame_words`), ``compression`` (ratio of the
+            words used by :func:`fit` to ``words``) and the maximum
+            absolute ``error`` at the samples in Volts.
+    """
+    voltages = np.atleast_2d(np.asarray(voltages, np.float64))
+    times = np.rint(np.broadcast_to(times, voltages.shape)).astype(np.int64)
+    if not 0 <= order <= 3:
+        raise ValueError("Only splines up to cubic order are supported.")
+    duration = np.diff(times)
+    if np.any(duration <= 0):
+        raise ValueError("times must be increasing")
+    # lines cover at least one sample interval
+    if np.any(duration >= 1 << 16):
+        raise ValueError("duration out of range")
+    frame, errors = [], []
+    for t, v in zip(times, voltages):
+        lines, error = _place(t, v, tolerance, order)
+        frame.append(lines)
+        errors.append(error)
+    words = frame_words(frame, len(frame))
+    dense = 4 + (times.shape[1] - 1)*int(Segment.line_words(0, order + 1))
+    stats = []
+    for lines, w, error in zip(frame, words, errors):
+        stats.append({
+            "samples": times.shape[1],
+            "lines": len(lines),
+            "words": int(w),
+            "compression": dense/w,
+            "error": error,
+        })
+    return frame, stats
@@ -0,0 +1,237 @@
+# Copyright 2013-2015 Robert Jordens <jordens@gmail.com>
+#
+# This file is part of pdq2.
+#
+# pdq2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pdq2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pdq2.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Precompiled stack images.
+
+A stack image holds the serialized memory images of the channels of a
+stack. It is written once after compilation and can be uploaded with
+:meth:`host.pdq2.Pdq2.load_image` without recompiling.
+
+All values are little-endian. The image starts with a 64 byte header:
+
+* ``magic`` (8 bytes): ``b"PDQ2IMG\\0"``
+* ``version`` (uint16): :data:`VERSION`
+* ``num_boards`` (uint16): Number of boards of the stack.
+* ``num_dacs`` (uint16): Number of DACs per board.
+* ``num_frames`` (uint16): Number of frames (frame table entries).
+* ``num_entries`` (uint16): Number of channel entries.
+* ``key`` (20 bytes): Hash of the compiled program and the compile
+  parameters (see :func:`host.cache.program_key`), zero if unknown.
+* ``digest`` (20 bytes): SHA-1 of the concatenated channel memory images.
+* 6 bytes padding
+
+It is followed by ``num_entries`` channel entries of 12 bytes each:
+
+* ``channel`` (uint16): Channel index (``board*num_dacs + dac``).
+* 2 bytes padding
+* ``offset`` (uint32): Offset of the memory image from the start of the
+  file in bytes.
+* ``length`` (uint32): Length of the memory image in bytes.
+
+The memory images follow. Each starts with the frame table.
+"""
+
+import hashlib
+import mmap
+import struct
+
+import numpy as np
+
+from .cache import program_key, write_atomic
+from .pdq2 import Segment
+
+
+#: Format version.
+VERSION = 1
+
+MAGIC = b"PDQ2IMG\0"
+
+_header = struct.Struct("<8sHHHHH20s20s6x")
+_entry = struct.Struct("<H2xII")
+
+
+def pack_image(images, num_boards, num_dacs=3, num_frames=8, key=None):
+    """Assemble a stack image.
+
+    Args:
+        images (list[tuple[int, bytes]]): Channel indices and their memory
+            images.
+        num_boards (int): Number of boards.
+        num_dacs (int): Number of DACs per board.
+        num_frames (int): Number of frames.
+        key (str): Hex digest of the compiled program.
+
+    Returns:
+        data (bytes): Stack image.
+    """
+    images = list(images)
+    key = bytes.fromhex(key) if key else bytes(20)
+    offset = _header.size + _entry.size*len(images)
+    entries = []
+    digest = hashlib.sha1()
+    for channel, data in images:
+        assert len(data) % 2 == 0
+        entries.append(_entry.pack(channel, offset, len(data)))
+        digest.update(data)
+        offset += len(data)
+    header = _header.pack(MAGIC, VERSION, num_boards, num_dacs, num_frames,
+                          len(images), key, digest.digest())
+    return b"".join([header] + entries + [data for channel, data in images])
+
+
+def compile_image(pdq, program, channels=None):
+    """Compile a wavesynth program into a stack image.
+
+    The program is compiled with :meth:`host.pdq2.Pdq2.compile`. Nothing is
+    written to the device.
+
+    Args:
+        pdq (host.pdq2.Pdq2): Stack to compile for.
+        program (list): Wavesynth program (list of frames).
+        channels (list[int]): Channel indices to use. If unspecified, all
+            channels are used.
+
+    Returns:
+        data (bytes): Stack image.
+    """
+    if channels is None:
+        channels = range(pdq.num_channels)
+    key = None
+    if isinstance(program, list):
+        key = program_key(program, Segment.out_scale, Segment.cordic_gain,
+                          VERSION)
+    return pack_image(pdq.compile(program, channels),
+                      pdq.num_boards, pdq.num_dacs,
+                      pdq.channels[0].num_frames, key)
+
+
+def save(path, data):
+    """Write a stack image to a file.
+
+    The file is replaced atomically.
+
+    Args:
+        path (str): File name.
+        data (bytes): Stack image.
+    """
+    write_atomic(path, data, prefix=".pdq2img-")
+
+
+class StackImage:
+    """Read access to a stack image.
+
+    The memory images are exposed as views into the underlying buffer
+    without copying.
+
+    Args:
+        buf (bytes): Stack image. Any object supporting the buffer protocol
+            can be used, e.g. an :class:`mmap.mmap`.
+
+    Attributes:
+        version (int): Format version.
+        num_boards (int): Number of boards.
+        num_dacs (int): Number of DACs per board.
+        num_frames (int): Number of frames.
+        key (str): Hex digest of the compiled program or ``None``.
+        digest (bytes): SHA-1 of the memory images.
+        channels (list[int]): Channel indices in the image.
+    """
+    def __init__(self, buf):
+        self._buf = buf
+        self._view = memoryview(buf).cast("B")
+        if len(self._view) < _header.size:
+            raise ValueError("truncated stack image")
+        (magic, self.version, self.num_boards, self.num_dacs,
+         self.num_frames, n, key, self.digest) = _header.unpack_from(
+             self._view)
+        if magic != MAGIC:
+            raise ValueError("not a stack image")
+        if self.version != VERSION:
+            raise ValueError("unsupported stack image version {}".format(
+                self.version))
+        self.key = key.hex() if any(key) else None
+        self._entries = {}
+        for i in range(n):
+            channel, offset, length = _entry.unpack_from(
+                self._view, _header.size + i*_entry.size)
+            if offset + length > len(self._view):
+                raise ValueError("truncated stack image")
+            self._entries[channel] = offset, length
+        self.channels = list(self._entries)
+
+    @classmethod
+    def open(cls, path):
+        """Map a stack image file into memory.
+
+        Args:
+            path (str): File name.
+
+        Returns:
+            :class:`StackImage`
+        """
+        with open(path, "rb") as f:
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def close(self):
+        """Release the buffer.
+
+        Views returned by :meth:`image` must have been released.
+        """
+        self._view.release()
+        close = getattr(self._buf, "close", None)
+        if close is not None:
+            close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def image(self, channel):
+        """Memory image of a channel.
+
+        Args:
+            channel (int): Channel index.
+
+        Returns:
+            data (memoryview): Memory image starting at address zero.
+        """
+        offset, length = self._entries[channel]
+        return self._view[offset:offset + length]
+
+    def table(self, channel):
+        """Frame address table of a channel.
+
+        Args:
+            channel (int): Channel index.
+
+        Returns:
+            table (array[uint16]): Start addresses of the frames.
+        """
+        return np.frombuffer(self.image(channel), "<u2", self.num_frames)
+
+    def verify(self):
+        """Check the memory images against the digest.
+
+        Returns:
+            valid (bool): Whether the images are intact.
+        """
+        digest = hashlib.sha1()
+        for channel in self.channels:
+            digest.update(self.image(channel))
+        return digest.digest() == self.digest
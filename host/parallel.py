@@ -0,0 +1,170 @@
+# Copyright 2013-2015 Robert Jordens <jordens@gmail.com>
+#
+# This file is part of pdq2.
+#
+# pdq2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pdq2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pdq2.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Parallel compilation of wavesynth programs.
+
+The channels of a stack are compiled independently. They are sharded
+across the workers of a :class:`concurrent.futures.Executor` (typically a
+:class:`concurrent.futures.ProcessPoolExecutor`). Each worker returns the
+segment data of its channels as a single contiguous buffer together with
+the segment lengths. The segments are then allocated and the channels are
+serialized in the calling process, so that the result is identical to
+serial compilation.
+"""
+
+from concurrent.futures import BrokenExecutor
+import logging
+import os
+import pickle
+
+from .pdq2 import Pdq2, Segment, _reiterable
+
+
+logger = logging.getLogger(__name__)
+
+
+class _Sink:
+    def write(self, data):
+        return len(data)
+
+
+def compile_shard(program, positions, out_scale=Segment.out_scale,
+                  cordic_gain=Segment.cordic_gain):
+    """Compile the frames of a wavesynth program for some channels.
+
+    Args:
+        program (list): Wavesynth program (list of frames).
+        positions (list[int]): Indices into the ``channel_data`` of each line
+            (or into each columnar frame) to compile.
+        out_scale (float): See :attr:`host.pdq2.Segment.out_scale`.
+        cordic_gain (float): See :attr:`host.pdq2.Segment.cordic_gain`.
+
+    Returns:
+        data (bytearray): Concatenated segment data, channel-major.
+        lengths (list[list[int]]): Segment lengths in bytes for each position
+            and frame.
+    """
+    pdq = Pdq2(dev=_Sink(), num_boards=0)
+    segments = [[] for i in positions]
+    n = max(positions) + 1
+    for frame in program:
+        row = [None] * n
+        for i, j in enumerate(positions):
+            row[j] = segment = Segment()
+            segment.out_scale = out_scale
+            segment.cordic_gain = cordic_gain
+            segments[i].append(segment)
+        pdq.program_frame(row, frame)
+    data = bytearray()
+    lengths = []
+    for frames in segments:
+        lengths.append([len(segment.data) for segment in frames])
+        for segment in frames:
+            data += segment.data
+    return data, lengths
+
+
+def shards(n, num_workers):
+    """Split channel positions into contiguous shards.
+
+    Args:
+        n (int): Number of channels.
+        num_workers (int): Number of workers.
+
+    Returns:
+        shards (list[list[int]]): At most ``num_workers`` non-empty lists of
+            positions.
+    """
+    num_workers = max(1, min(n, num_workers))
+    return [list(range(i*n//num_workers, (i + 1)*n//num_workers))
+            for i in range(num_workers)]
+
+
+def compile_channels(pdq, program, channels, executor, num_workers=None):
+    """Compile channels of a stack in parallel.
+
+    The program is compiled serially (see :meth:`host.pdq2.Pdq2.program`)
+    if it is given as an iterator, if a :attr:`host.pdq2.Pdq2.cache` is
+    configured, or if the executor is unavailable or fails (a broken or
+    shut down process pool or an unpicklable program). Errors in the
+    program are raised.
+
+    Args:
+        pdq (host.pdq2.Pdq2): Stack.
+        program (list): Wavesynth program (list of frames).
+        channels (list[int]): Channel indices to use.
+        executor (concurrent.futures.Executor): Executor to compile on.
+        num_workers (int): Number of shards to split the channels into
+            (see :func:`shards`). Defaults to the number of CPUs.
+
+    Yields:
+        channel (int): Channel index.
+        data (bytes): Serialized channel memory image.
+    """
+    channels = list(channels)
+    if not channels:
+        return
+    if pdq.cache is not None or not (
+            _reiterable(program) and
+            all(_reiterable(frame) for frame in program)):
+        yield from pdq._compile_channels(program, channels)
+        return
+    try:
+        # unpicklable objects also raise AttributeError or TypeError,
+        # in the workers those can not be told apart from program errors
+        pickle.dumps(program, pickle.HIGHEST_PROTOCOL)
+    except (pickle.PicklingError, AttributeError, TypeError) as e:
+        yield from _serial(pdq, program, channels, e)
+        return
+    try:
+        results = _submit(pdq, program, channels, executor, num_workers)
+    except (BrokenExecutor, RuntimeError, OSError,
+            pickle.PicklingError) as e:
+        yield from _serial(pdq, program, channels, e)
+        return
+    for positions, (data, lengths) in results:
+        view = memoryview(data)
+        start = 0
+        for i, frames in zip(positions, lengths):
+            ch = pdq.channels[channels[i]]
+            ch.clear()
+            for length in frames:
+                ch.new_segment()._append(view[start:start + length])
+                start += length
+            yield channels[i], ch.serialize()
+
+
+def _serial(pdq, program, channels, error):
+    logger.warning("parallel compilation failed (%r), compiling serially",
+                   error)
+    yield from pdq._compile_channels(program, channels)
+
+
+def _submit(pdq, program, channels, executor, num_workers):
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    parts = shards(len(channels), num_workers)
+    futures = [executor.submit(compile_shard, program, positions,
+                               Segment.out_scale, Segment.cordic_gain)
+               for positions in parts]
+    try:
+        return [(positions, future.result())
+                for positions, future in zip(parts, futures)]
+    except BaseException:
+        for future in futures:
+            future.cancel()
+        raise
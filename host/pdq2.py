@@ -15,12 +15,23 @@
 # You should have received a copy of the GNU General Public License
 # along with pdq2.  If not, see <http://www.gnu.org/licenses/>.
 
-from math import log, sqrt
+from math import factorial, sqrt
+import bisect
+import hashlib
 import logging
+from collections.abc import Sequence
+from queue import Queue
 import struct
+import threading
+from time import perf_counter
 
+import numpy as np
 import serial
 
+from .cache import FORMAT_VERSION
+from .escape import Escaper
+from .wavesynth import integer_divider, is_columnar
+
 
 logger = logging.getLogger(__name__)
 
@@ -44,6 +55,141 @@ def discrete_compensate(c):
         raise ValueError("Only splines up to cubic order are supported.")
 
 
+def _max_slope(amplitude, t):
+    # maximum absolute derivative of a spline over [0, t]
+    d = list(amplitude[1:4]) + [0.]*(4 - len(amplitude))
+    ts = [0., t]
+    if d[2]:
+        ts.append(min(max(-d[1]/d[2], 0.), t))
+    return max(abs(d[0] + d[1]*ti + d[2]*ti**2/2) for ti in ts)
+
+
+def _max_steps(amplitude, shift, max_time):
+    # longest line with a cubic rounding error of at most one DAC LSB
+    if len(amplitude) < 4 or not amplitude[3]:
+        return max_time
+    c = abs(amplitude[3])*Segment.out_scale*(1 << 3*shift)
+    return max(1, min(max_time, int((6/min(c, 2.**-33))**(1/3))))
+
+
+def split_line(duration, amplitude=[], phase=[], dac_divider=1,
+               max_time=(1 << 16) - 1, min_cycles=18):
+    """Split a line into lines that the gateware can execute.
+
+    Lines longer than ``max_time`` steps are split into several lines. A
+    ``dac_divider`` that is not a power of two is converted to ``shift=0``
+    (the spline is then evaluated every clock cycle). The coefficients are
+    re-based to the start of each line. Later lines do not clear the phase
+    accumulator so that the phase stays continuous.
+
+    The lines are short enough that the rounding of the cubic coefficient
+    causes no more than one DAC LSB of error. The shift is increased beyond
+    ``log2(dac_divider)`` if that reduces the number of lines, the coarser
+    stepping deviates from the spline by no more than one DAC LSB, and
+    there is no phase chirp. Constant holds of up to ``2**31`` clock cycles
+    therefore take at most two lines.
+
+    Args:
+        duration (int): Duration in units of ``dac_divider`` clock cycles.
+        amplitude (list[float]): Amplitude coefficients, see
+            :meth:`Segment.bias`, in powers of
+            ``1/(dac_divider*clock_period)``.
+        phase (list[float]): Phase coefficients, see :meth:`Segment.dds`.
+        dac_divider (int): Clock cycles per time step.
+        max_time (int): Maximum duration of a line.
+        min_cycles (int): Minimum number of clock cycles of the last line
+            of a split line. Shorter lines stall the memory parser.
+
+    Returns:
+        lines (list[tuple[int, int, list[float], list[float]]]): Duration,
+            shift, amplitude and phase coefficients of each line.
+    """
+    dac_divider = integer_divider(dac_divider)
+    shift = dac_divider.bit_length() - 1
+    if 1 << shift != dac_divider:
+        shift = 0
+    elif shift > 15:
+        # four bit shift field
+        raise ValueError("dac_divider out of range")
+    elif 0 <= duration <= max_time:
+        return [(duration, shift, amplitude, phase)]
+    cycles = duration*dac_divider
+    if cycles <= 0:
+        raise ValueError("duration out of range")
+    # coefficients per clock cycle
+    a = [ai/dac_divider**i for i, ai in enumerate(amplitude)]
+    p = list(phase)
+    chirp = p[2]/dac_divider if len(p) > 2 else 0.
+    best = None
+    for s in range(shift, 16):
+        if s > shift and (chirp or _max_slope(a, cycles)*((1 << s) - 1) >
+                          1/Segment.out_scale):
+            break
+        # whole steps at shift s and the rest at the base shift
+        q, r = divmod(cycles, 1 << s)
+        if 0 < r < min_cycles:
+            k = min(q, -(-(min_cycles - r) >> s))
+            q -= k
+            r += k << s
+        m = -(-q//_max_steps(a, s, max_time))
+        n = -(-(r >> shift)//_max_steps(a, shift, max_time))
+        if best is None or m + n < best[0] + best[1]:
+            best = m, n, s, q, r
+    m, n, s, q, r = best
+    pieces = [(q*(i + 1)//m - q*i//m, s) for i in range(m)]
+    r >>= shift
+    pieces += [(r*(i + 1)//n - r*i//n, shift) for i in range(n)]
+    lines = []
+    start = 0
+    for steps, s in pieces:
+        ai = [sum(a[k + j]*start**j/factorial(j)
+                  for j in range(len(a) - k))*(1 << s*k)
+              for k in range(len(a))]
+        pi = list(p)
+        if len(p) > 1:
+            pi[1] = p[1] + chirp*start
+        if len(p) > 2:
+            pi[2] = chirp*(1 << s)
+        lines.append((steps, s, ai, pi))
+        start += steps << s
+    return lines
+
+
+def _reiterable(obj):
+    return isinstance(obj, (Sequence, np.ndarray))
+
+
+def changed_ranges(old, new, overhead=3):
+    """Determine the word address ranges that differ between two memory
+    images.
+
+    Ranges that are separated by no more than ``overhead`` unchanged words
+    are merged since rewriting the unchanged words is cheaper than the
+    header of another memory write.
+
+    Args:
+        old (bytes): Previous memory image.
+        new (bytes): New memory image. Words beyond the end of ``old`` are
+            considered changed.
+        overhead (int): Overhead of a memory write in words.
+
+    Returns:
+        ranges (list[tuple[int, int]]): Start and end (exclusive) word
+            addresses of the changed ranges.
+    """
+    new = np.frombuffer(new, "<u2")
+    old = np.frombuffer(old, "<u2", len(old)//2)[:len(new)]
+    changed = np.ones(len(new), bool)
+    changed[:len(old)] = old != new[:len(old)]
+    idx = np.flatnonzero(changed)
+    if not len(idx):
+        return []
+    breaks = np.flatnonzero(np.diff(idx) > overhead + 1)
+    starts = np.r_[idx[0], idx[breaks + 1]]
+    ends = np.r_[idx[breaks], idx[-1]] + 1
+    return list(zip(starts.tolist(), ends.tolist()))
+
+
 class Segment:
     """Serialize the lines for a single Segment.
 
@@ -54,7 +200,7 @@ class Segment:
         out_scale (float): Steps per Volt.
         cordic_gain (float): CORDIC amplitude gain.
         addr (int): Address assigned to this segment.
-        data (bytes): Serialized segment data.
+        data (memoryview): Read-only view of the serialized segment data.
     """
     max_time = 1 << 16  # uint16 timer
     max_val = 1 << 15  # int16 DAC
@@ -65,9 +211,29 @@ class Segment:
         cordic_gain *= sqrt(1 + 2**(-2*i))
 
     def __init__(self):
-        self.data = b""
+        self._buf = bytearray(64)
+        self._size = 0
         self.addr = None
 
+    @property
+    def data(self):
+        return memoryview(self._buf)[:self._size].toreadonly()
+
+    def _append(self, data):
+        """Append raw data to the segment buffer.
+
+        The buffer grows geometrically. Views handed out by :attr:`data`
+        remain valid.
+        """
+        data = memoryview(data).cast("B")
+        size = self._size + len(data)
+        if size > len(self._buf):
+            buf = bytearray(max(size, 2*len(self._buf)))
+            buf[:self._size] = memoryview(self._buf)[:self._size]
+            self._buf = buf
+        self._buf[self._size:size] = data
+        self._size = size
+
     def line(self, typ, duration, data, trigger=False, silence=False,
              aux=False, shift=0, jump=False, clear=False, wait=False):
         """Append a line to this segment.
@@ -96,7 +262,50 @@ class Segment:
             (aux << 8) | (shift << 9) | (jump << 13) | (clear << 14) |
             (wait << 15)
         )
-        self.data += struct.pack("<HH", header, duration) + data
+        self._append(struct.pack("<HH", header, duration))
+        self._append(data)
+
+    def lines(self, typ, duration, data, length=None, trigger=False,
+              silence=False, aux=False, shift=0, jump=False, clear=False,
+              wait=False):
+        """Append many lines to this segment.
+
+        Vectorized equivalent of calling :meth:`line` for each row of
+        ``data``. The flags can be scalars (applied to all lines) or arrays
+        with one entry per line.
+
+        Args:
+            typ (int): Output module to target with these lines.
+            duration (array[int]): Durations of the lines.
+            data (array[uint16]): Data words for the output module, one row
+                per line.
+            length (array[int]): Number of data words used in each line. If
+                not specified, all words of each row are used.
+            trigger, silence, aux, shift, jump, clear, wait: See :meth:`line`.
+        """
+        data = np.asarray(data, np.uint16)
+        n, m = data.shape
+        duration = np.asarray(duration, int)
+        if np.any((duration < 0) | (duration >= self.max_time)):
+            raise ValueError("duration out of range")
+        if length is None:
+            length = m
+        length = np.asarray(length, int)
+        assert np.all(length <= 14)
+        header = (
+            1 + length | (np.asarray(typ, int) << 4) |
+            (np.asarray(trigger, int) << 6) |
+            (np.asarray(silence, int) << 7) | (np.asarray(aux, int) << 8) |
+            (np.asarray(shift, int) << 9) | (np.asarray(jump, int) << 13) |
+            (np.asarray(clear, int) << 14) | (np.asarray(wait, int) << 15)
+        )
+        words = np.empty((n, 2 + m), "<u2")
+        words[:, 0] = header
+        words[:, 1] = duration
+        words[:, 2:] = data
+        if length.ndim:
+            words = words[np.arange(2 + m) < 2 + length[:, None]]
+        self._append(words)
 
     @staticmethod
     def pack(widths, values):
@@ -127,6 +336,38 @@ class Segment:
                          values, widths, ud, fmt, e)
             raise e
 
+    @staticmethod
+    def pack_array(widths, values):
+        """Pack spline data for many lines.
+
+        Vectorized equivalent of :meth:`pack`.
+
+        Args:
+            widths (list[int]): Widths of values in multiples of 16 bits.
+            values (array[float]): Values to pack. One row per line and one
+                column per value. Only the first ``values.shape[1]`` widths
+                are used.
+
+        Returns:
+            data (array[uint16]): Packed data words. One row per line.
+        """
+        values = np.asarray(values, np.float64)
+        words = []
+        for width, value in zip(widths, values.T):
+            value = np.rint(value * (1 << 16*width))
+            limit = 1 << 16*width + 15
+            bad = ~((value >= -limit) & (value < limit))
+            if np.any(bad):
+                i = np.flatnonzero(bad)[0]
+                raise ValueError("can not pack {} as {} (line {})".format(
+                    values[i], widths, i))
+            value = value.astype(np.int64)
+            for i in range(width + 1):
+                words.append((value >> 16*i) & 0xffff)
+        if not words:
+            return np.empty((len(values), 0), np.uint16)
+        return np.array(words, np.uint16).T
+
     def bias(self, amplitude=[], **kwargs):
         """Append a bias line to this segment.
 
@@ -141,6 +382,23 @@ class Segment:
         data = self.pack([0, 1, 2, 2], coef)
         self.line(typ=0, data=data, **kwargs)
 
+    def bias_lines(self, duration, amplitude, **kwargs):
+        """Append many bias lines to this segment.
+
+        Vectorized equivalent of calling :meth:`bias` for each line.
+
+        Args:
+            duration (array[int]): Durations of the lines.
+            amplitude (array[float]): Amplitude coefficients. One row per
+                line, see :meth:`bias`. All lines have the same number of
+                coefficients.
+            **kwargs: Passed to :meth:`lines`.
+        """
+        coef = self.out_scale*np.asarray(amplitude, np.float64)
+        discrete_compensate(coef.T)
+        data = self.pack_array([0, 1, 2, 2], coef)
+        self.lines(typ=0, duration=duration, data=data, **kwargs)
+
     def dds(self, amplitude=[], phase=[], **kwargs):
         """Append a DDS line to this segment.
 
@@ -164,6 +422,226 @@ class Segment:
         data = self.pack([0, 1, 2, 2, 0, 1, 1], coef)
         self.line(typ=1, data=data, **kwargs)
 
+    # data words used by the first n coefficients
+    _bias_words = np.array([0, 1, 3, 6, 9])
+    _phase_words = np.array([0, 1, 3, 5])
+
+    @classmethod
+    def line_words(cls, typ, amplitude_len, phase_len=0):
+        """Number of memory words of lines.
+
+        Vectorized over the arguments. Determined from the number of
+        coefficients only, without packing.
+
+        Args:
+            typ (array[int]): Target, ``0`` for ``bias``, ``1`` for ``dds``.
+            amplitude_len (array[int]): Number of amplitude coefficients.
+            phase_len (array[int]): Number of phase coefficients.
+
+        Returns:
+            words (array[int]): Number of 16 bit words including the line
+                header and duration.
+        """
+        typ = np.asarray(typ)
+        amplitude_len = np.asarray(amplitude_len)
+        phase_len = np.asarray(phase_len)
+        return 2 + np.where(
+            (typ == 1) & (phase_len > 0),
+            9 + cls._phase_words[np.minimum(phase_len, 3)],
+            cls._bias_words[np.minimum(amplitude_len, 4)])
+
+    def extend(self, lines):
+        """Append lines in the columnar format to this segment.
+
+        Vectorized equivalent of calling :meth:`bias` or :meth:`dds` for
+        each line.
+
+        Args:
+            lines (array[line_dtype]): Lines in the columnar format. See
+                :data:`host.wavesynth.line_dtype`.
+        """
+        dds = lines["typ"] == 1
+        scale = np.where(dds, self.out_scale/self.cordic_gain, self.out_scale)
+        coef = np.zeros((len(lines), 7))
+        coef[:, :4] = scale[:, None]*lines["amplitude"]
+        discrete_compensate(coef[:, :4].T)
+        coef[:, 4:] = lines["phase"]*self.max_val*2
+        data = self.pack_array([0, 1, 2, 2, 0, 1, 1], coef)
+        length = np.where(
+            dds & (lines["phase_len"] > 0),
+            9 + self._phase_words[lines["phase_len"]],
+            self._bias_words[lines["amplitude_len"]])
+        self.lines(typ=lines["typ"], duration=lines["duration"], data=data,
+                   length=length, trigger=lines["trigger"],
+                   silence=lines["silence"], shift=lines["shift"],
+                   clear=lines["clear"])
+
+    def dds_lines(self, duration, amplitude, phase=None, **kwargs):
+        """Append many DDS lines to this segment.
+
+        Vectorized equivalent of calling :meth:`dds` for each line.
+
+        Args:
+            duration (array[int]): Durations of the lines.
+            amplitude (array[float]): Amplitude coefficients. One row per
+                line, see :meth:`dds`.
+            phase (array[float]): Phase coefficients. One row per line, see
+                :meth:`dds`.
+            **kwargs: Passed to :meth:`lines`.
+        """
+        scale = self.out_scale/self.cordic_gain
+        coef = scale*np.asarray(amplitude, np.float64)
+        discrete_compensate(coef.T)
+        if phase is not None and np.shape(phase)[1]:
+            assert coef.shape[1] == 4
+            coef = np.hstack([coef, np.asarray(phase)*self.max_val*2])
+        data = self.pack_array([0, 1, 2, 2, 0, 1, 1], coef)
+        self.lines(typ=1, duration=duration, data=data, **kwargs)
+
+
+class AllocationError(ValueError):
+    """Insufficient channel memory.
+
+    Attributes:
+        size (int): Number of words requested.
+        available (int): Total number of free words.
+        largest (int): Size of the largest free block in words.
+    """
+    def __init__(self, size, available, largest):
+        ValueError.__init__(
+            self, "can not allocate {} words: {} words available, "
+            "largest free block {} words".format(size, available, largest))
+        self.size = size
+        self.available = available
+        self.largest = largest
+
+
+class Allocator:
+    """Best-fit free list memory allocator.
+
+    Args:
+        start (int): First allocatable address.
+        end (int): End of the allocatable memory (exclusive).
+
+    Attributes:
+        free_blocks (list[tuple[int, int]]): Address and size of the free
+            blocks, sorted by address.
+    """
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+        self.reset()
+
+    def reset(self):
+        """Free all memory."""
+        self.free_blocks = [(self.start, self.end - self.start)]
+
+    def available(self):
+        """Total number of free words."""
+        return sum(size for addr, size in self.free_blocks)
+
+    def largest(self):
+        """Size of the largest free block in words."""
+        return max((size for addr, size in self.free_blocks), default=0)
+
+    def alloc(self, size):
+        """Allocate a block of memory.
+
+        The smallest free block that can hold ``size`` words is used.
+
+        Args:
+            size (int): Number of words.
+
+        Returns:
+            addr (int): Start address of the allocated block.
+        """
+        best = None
+        for i, (addr, free) in enumerate(self.free_blocks):
+            if free >= size and (best is None or
+                                 free < self.free_blocks[best][1]):
+                best = i
+        if best is None:
+            raise AllocationError(size, self.available(), self.largest())
+        addr, free = self.free_blocks[best]
+        if free == size:
+            del self.free_blocks[best]
+        else:
+            self.free_blocks[best] = addr + size, free - size
+        return addr
+
+    def claim(self, addr, size):
+        """Allocate a given block of memory.
+
+        Args:
+            addr (int): Start address.
+            size (int): Number of words.
+        """
+        if not size:
+            return
+        for i, (start, free) in enumerate(self.free_blocks):
+            if start <= addr and addr + size <= start + free:
+                break
+        else:
+            raise AllocationError(size, self.available(), self.largest())
+        blocks = []
+        if addr > start:
+            blocks.append((start, addr - start))
+        if addr + size < start + free:
+            blocks.append((addr + size, start + free - addr - size))
+        self.free_blocks[i:i + 1] = blocks
+
+    def free(self, addr, size):
+        """Return a block of memory to the free list.
+
+        Adjacent free blocks are merged.
+
+        Args:
+            addr (int): Start address.
+            size (int): Number of words.
+        """
+        if not size:
+            return
+        i = bisect.bisect(self.free_blocks, (addr, size))
+        if i < len(self.free_blocks):
+            start, free = self.free_blocks[i]
+            assert addr + size <= start, (addr, size)
+            if addr + size == start:
+                size += free
+                del self.free_blocks[i]
+        if i > 0:
+            start, free = self.free_blocks[i - 1]
+            assert start + free <= addr, (addr, size)
+            if start + free == addr:
+                addr, size = start, free + size
+                i -= 1
+                del self.free_blocks[i]
+        self.free_blocks.insert(i, (addr, size))
+
+    def stats(self):
+        """Memory usage and fragmentation statistics.
+
+        Returns:
+            stats (dict): ``free``: number of free words,
+                ``used``: number of allocated words,
+                ``largest``: size of the largest free block,
+                ``blocks``: number of free blocks,
+                ``fragmentation``: ``1 - largest/free``.
+        """
+        free = self.available()
+        largest = self.largest()
+        return {
+            "free": free,
+            "used": self.end - self.start - free,
+            "largest": largest,
+            "blocks": len(self.free_blocks),
+            "fragmentation": 1 - largest/free if free else 0.,
+        }
+
+
+def _digest(data):
+    # key of identical segment data without keeping a copy of it
+    return hashlib.sha1(data).digest()
+
 
 class Channel:
     """PDQ2 Channel.
@@ -172,16 +650,28 @@ class Channel:
         num_frames (int): Number of frames supported.
         max_data (int): Number of 16 bit data words per channel.
         segments (list[Segment]): Segments added to this channel.
+        entry (list[Segment]): Frame entry segments as last serialized or
+            updated. ``None`` for unused frames.
+        deduplicated (int): Number of words saved by sharing identical
+            segments in the last :meth:`place`.
+        allocator (Allocator): Memory allocator for the segment data.
     """
     num_frames = 8
     max_data = 4*(1 << 10)  # 8kx16 8kx16 4kx16
 
     def __init__(self):
         self.segments = []
+        self.entry = [None] * self.num_frames
+        self.deduplicated = 0
+        self.allocator = Allocator(self.num_frames, self.max_data)
+        self._blocks = {}
 
     def clear(self):
         """Remove all segments."""
         self.segments.clear()
+        self.entry = [None] * self.num_frames
+        self.allocator.reset()
+        self._blocks.clear()
 
     def new_segment(self):
         """Create and attach a new :class:`Segment` to this channel.
@@ -193,19 +683,78 @@ class Channel:
         self.segments.append(segment)
         return segment
 
+    def allocate(self, segment):
+        """Allocate memory for a segment.
+
+        Segments with identical data share their memory.
+
+        Args:
+            segment (Segment): Segment to allocate memory for. Its address
+                is assigned.
+
+        Returns:
+            new (bool): Whether new memory was allocated. If ``False``, an
+                identical segment is already in memory.
+        """
+        key = _digest(segment.data)
+        block = self._blocks.get(key)
+        new = block is None
+        if new:
+            block = self._blocks[key] = [
+                self.allocator.alloc(len(segment.data)//2), 0]
+        block[1] += 1
+        segment.addr = block[0]
+        return new
+
+    def free(self, segment):
+        """Release the memory of a segment.
+
+        Args:
+            segment (Segment): Segment to release.
+        """
+        key = _digest(segment.data)
+        block = self._blocks.get(key)
+        if block is None or block[0] != segment.addr:
+            # a copy of shared data with its own memory, see load()
+            self.allocator.free(segment.addr, len(segment.data)//2)
+        else:
+            block[1] -= 1
+            if not block[1]:
+                del self._blocks[key]
+                self.allocator.free(block[0], len(segment.data)//2)
+        segment.addr = None
+
+    def stats(self):
+        """Memory usage statistics.
+
+        See :meth:`Allocator.stats`.
+        """
+        return self.allocator.stats()
+
     def place(self):
         """Place segments contiguously.
 
         Assign segment start addresses and determine length of data.
+        Segments with identical data are placed only once and share their
+        address. The number of words saved is stored in
+        :attr:`deduplicated`.
+
+        Placing compacts the memory: all previous allocations are
+        discarded.
 
         Returns:
             addr (int): Amount of memory in use on this channel.
         """
+        self.allocator.reset()
+        self._blocks.clear()
         addr = self.num_frames
+        self.deduplicated = 0
         for segment in self.segments:
-            segment.addr = addr
-            addr += len(segment.data)//2
-        assert addr <= self.max_data, addr
+            size = len(segment.data)//2
+            if self.allocate(segment):
+                addr = max(addr, segment.addr + size)
+            else:
+                self.deduplicated += size
         return addr
 
     def table(self, entry=None):
@@ -237,19 +786,198 @@ class Channel:
     def serialize(self, entry=None):
         """Serialize the memory for this channel.
 
-        Places the segments contiguously in memory after the frame table.
+        Places the segments contiguously in memory after the frame table,
+        sharing identical segments (see :meth:`place`).
         Allocates and assigns segment and frame table addresses.
         Serializes segment data and prepends frame address table.
 
         Args:
-            entry (list[Segment]): See :meth:`table`.
+            entry (list[Segment]): See :meth:`table`. At most
+                :attr:`num_frames` entries.
 
         Returns:
-            data (bytes): Channel memory data.
+            data (bytearray): Channel memory data.
         """
-        self.place()
-        data = b"".join([segment.data for segment in self.segments])
-        return self.table(entry) + data
+        if entry is None:
+            entry = self.segments
+        if len(entry) > self.num_frames:
+            raise ValueError("too many frames: {} > {}".format(
+                len(entry), self.num_frames))
+        entry = list(entry)
+        self.entry = entry + [None] * (self.num_frames - len(entry))
+        data = bytearray(2*self.place())
+        data[:2*self.num_frames] = self.table(self.entry)
+        written = set()
+        for segment in self.segments:
+            if segment.addr in written:
+                continue
+            written.add(segment.addr)
+            addr = 2*segment.addr
+            view = segment.data
+            data[addr:addr + len(view)] = view
+        return data
+
+    def load(self, data):
+        """Restore the channel from a memory image.
+
+        The inverse of :meth:`serialize`. The segments are delimited by
+        the frame table addresses and the end of the image. Their memory is
+        allocated and they become the frame entry segments. Frames with
+        the same address share their entry segment. Identical segments at
+        different addresses keep their own memory.
+
+        Args:
+            data (bytes): Channel memory data as returned by
+                :meth:`serialize`.
+        """
+        self.clear()
+        view = memoryview(data).cast("B")
+        table = np.frombuffer(view, "<u2", self.num_frames).tolist()
+        starts = sorted(set(table) - {0})
+        segments = {}
+        for start, end in zip(starts, starts[1:] + [len(view)//2]):
+            segment = self.new_segment()
+            segment._append(view[2*start:2*end])
+            self.allocator.claim(start, end - start)
+            # copies of identical data are not shared, see free()
+            self._blocks.setdefault(_digest(segment.data), [start, 1])
+            segment.addr = start
+            segments[start] = segment
+        self.entry = [segments.get(addr) for addr in table]
+
+    def update(self, index, segment):
+        """Replace the entry segment of a frame.
+
+        The new segment is allocated while the old segment is still in
+        use such that it can be written while the old segment is being
+        executed.
+        If that is not possible, the old segment is released first.
+        Then, the new segment may overlap the old one.
+        The other segments and their addresses are unaffected.
+        If the new segment can not be allocated, the channel is left
+        unchanged.
+
+        Args:
+            index (int): Frame index.
+            segment (Segment): New entry segment for the frame.
+
+        Returns:
+            new (bool): Whether the segment data needs to be written.
+                See :meth:`allocate`.
+        """
+        old = self.entry[index]
+        try:
+            new = self.allocate(segment)
+        except AllocationError:
+            if old is None:
+                raise
+            state = self._save()
+            self.remove(index)
+            old = None
+            try:
+                new = self.allocate(segment)
+            except AllocationError:
+                self._restore(state)
+                raise
+        self.entry[index] = segment
+        self.segments.append(segment)
+        if old is not None:
+            self._release(old)
+        return new
+
+    def remove(self, index):
+        """Remove a frame.
+
+        The entry segment of the frame is released unless it is also the
+        entry segment of other frames.
+
+        Args:
+            index (int): Frame index.
+        """
+        old = self.entry[index]
+        self.entry[index] = None
+        if old is not None:
+            self._release(old)
+
+    def _save(self):
+        # the state changed by update() and remove()
+        return (list(self.allocator.free_blocks), list(self.entry),
+                list(self.segments),
+                {key: list(block) for key, block in self._blocks.items()},
+                [segment.addr for segment in self.segments])
+
+    def _restore(self, state):
+        free_blocks, entry, segments, blocks, addrs = state
+        self.allocator.free_blocks = free_blocks
+        self.entry = entry
+        self.segments = segments
+        self._blocks = blocks
+        for segment, addr in zip(segments, addrs):
+            segment.addr = addr
+
+    def _release(self, segment):
+        if segment not in self.entry:
+            self.segments.remove(segment)
+            self.free(segment)
+
+    def compact(self):
+        """Compact the channel memory.
+
+        Re-places all segments contiguously (see :meth:`place`) and
+        serializes the channel (see :meth:`serialize`). The complete
+        channel memory needs to be rewritten afterwards.
+
+        Returns:
+            data (bytearray): Channel memory data.
+        """
+        return self.serialize(self.entry)
+
+
+def frame_words(frame, num_channels):
+    """Number of memory words used by a wavesynth frame on each channel.
+
+    The word counts are determined from the number of spline coefficients
+    of each line (see :meth:`Segment.line_words`) and include the lines
+    added by :meth:`Pdq2.program_frame` and by splitting long lines (see
+    :func:`split_line`). Nothing is compiled.
+
+    Args:
+        frame (list): Wavesynth frame (list of lines) or columnar frame (see
+            :mod:`host.wavesynth`).
+        num_channels (int): Number of channels.
+
+    Returns:
+        words (array[int]): Number of 16 bit words for each channel.
+    """
+    # guard lines
+    words = np.full(num_channels, 4)
+    if is_columnar(frame):
+        for i, lines in enumerate(frame[:num_channels]):
+            words[i] += Segment.line_words(
+                lines["typ"], lines["amplitude_len"],
+                lines["phase_len"]).sum()
+        return words
+    index, typ, amplitude_len, phase_len, count = [], [], [], [], []
+    for line in frame:
+        dac_divider = integer_divider(line.get("dac_divider", 1))
+        duration = line["duration"]
+        split = (dac_divider & (dac_divider - 1) or dac_divider >= 1 << 16 or
+                 not 0 <= duration < Segment.max_time)
+        for i, data in enumerate(line["channel_data"][:num_channels]):
+            for target, target_data in data.items():
+                amplitude = target_data.get("amplitude", ())
+                phase = target_data.get("phase", ())
+                index.append(i)
+                typ.append(target == "dds")
+                amplitude_len.append(len(amplitude))
+                phase_len.append(len(phase))
+                count.append(len(split_line(duration, amplitude, phase,
+                                            dac_divider)) if split else 1)
+    if index:
+        words += np.bincount(
+            index, Segment.line_words(typ, amplitude_len, phase_len)*count,
+            num_channels).astype(int)
+    return words
 
 
 class Pdq2:
@@ -264,25 +992,48 @@ class Pdq2:
         dev (file-like): File handle to use as device. If passed, ``url`` is
             ignored.
         num_boards (int): Number of boards in this stack.
+        cache (SegmentCache): Cache of serialized frame segments. If passed,
+            only frames whose lines changed are compiled by
+            :meth:`program`. See :class:`host.cache.SegmentCache`.
+        differential (bool): Keep a shadow copy of the channel memories and
+            only write the changed address ranges in :meth:`write_channel`.
+        disk_cache (DiskCache): Persistent cache of channel memory images.
+            If passed, :meth:`program` only compiles channels whose images
+            are not in the cache. See :class:`host.cache.DiskCache`.
+        stats (UploadStats): Upload instrumentation. If passed, the data
+            written is accounted for. See :class:`host.stats.UploadStats`.
 
     Attributes:
         num_dacs (int): Number of DAC outputs per board.
         num_channels (int): Number of channels in this stack.
         num_boards (int): Number of boards in this stack.
         channels (list[Channel]): List of :class:`Channel` in this stack.
+        cache (SegmentCache): Segment cache or ``None``.
+        differential (bool): Differential memory writes enabled.
+        disk_cache (DiskCache): Channel image cache or ``None``.
+        shadow (list[bytearray]): Shadow copies of the channel memories as
+            last written. ``None`` if unknown, also after a failed write.
+        stats (UploadStats): Upload instrumentation or ``None``.
     """
     num_dacs = 3
 
     _escape = b"\xa5"
     _commands = "RESET TRIGGER ARM DCM START".split()
 
-    def __init__(self, url=None, dev=None, num_boards=3):
+    def __init__(self, url=None, dev=None, num_boards=3, cache=None,
+                 differential=False, disk_cache=None, stats=None):
         if dev is None:
             dev = serial.serial_for_url(url)
         self.dev = dev
         self.num_boards = num_boards
         self.num_channels = self.num_dacs * self.num_boards
         self.channels = [Channel() for i in range(self.num_channels)]
+        self.cache = cache
+        self.differential = differential
+        self.disk_cache = disk_cache
+        self.shadow = [None] * self.num_channels
+        self.stats = stats
+        self._escaper = Escaper(self._escape[0])
 
     def close(self):
         """Close the USB device handle."""
@@ -295,11 +1046,30 @@ class Pdq2:
         Args:
             data (bytes): Data to write.
         """
-        logger.debug("> %r", data)
-        written = self.dev.write(data)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("> %r", bytes(data))
+        stats = self.stats
+        if stats is None:
+            written = self.dev.write(data)
+        else:
+            t0 = perf_counter()
+            written = self.dev.write(data)
+            stats.write(len(data), perf_counter() - t0)
         if isinstance(written, int):
             assert written == len(data)
 
+    def _send(self, chunks):
+        """Write a sequence of data chunks.
+
+        All writes that are generated by the higher level methods are
+        funneled through this method.
+
+        Args:
+            chunks (iterable[bytes]): Data chunks to write.
+        """
+        for chunk in chunks:
+            self.write(chunk)
+
     def cmd(self, cmd, enable):
         """Execute a command.
 
@@ -312,48 +1082,360 @@ class Pdq2:
         cmd = self._commands.index(cmd) << 1
         if not enable:
             cmd |= 1
-        self.write(struct.pack("cb", self._escape, cmd))
+        if self.stats is not None:
+            self.stats.commands += 1
+        return self._send([struct.pack("cb", self._escape, cmd)])
 
     def write_mem(self, channel, data, start_addr=0):
         """Write to channel memory.
 
+        The data is escaped and written in chunks (see
+        :class:`host.escape.Escaper`).
+
         Args:
             channel (int): Channel index to write to. Assumes every board in
                 the stack has :attr:`num_dacs` DAC outputs.
             data (bytes): Data to write to memory.
             start_addr (int): Start address to write data to.
         """
+        return self._send(self._write_mem(channel, data, start_addr))
+
+    def _write_mem(self, channel, data, start_addr=0):
+        # the shadow copy is unknown until the write has completed: a
+        # failed write leaves it invalidated
+        shadow = self.shadow[channel]
+        self.shadow[channel] = None
         board, dac = divmod(channel, self.num_dacs)
-        data = struct.pack("<HHH", (board << 4) | dac, start_addr,
-                           start_addr + len(data)//2 - 1) + data
-        data = data.replace(self._escape, self._escape + self._escape)
-        self.write(data)
+        header = struct.pack("<HHH", (board << 4) | dac, start_addr,
+                             start_addr + len(data)//2 - 1)
+        header = header.replace(self._escape, self._escape + self._escape)
+        stats = self.stats
+        if stats is None:
+            yield header
+            yield from self._escaper.encode(data)
+        else:
+            t0 = perf_counter()
+            size = len(header)
+            yield header
+            for chunk in self._escaper.encode(data):
+                size += len(chunk)
+                yield chunk
+            stats.mem_write(6 + len(data), size, perf_counter() - t0)
+        if shadow is not None:
+            end = 2*start_addr + len(data)
+            if end > len(shadow):
+                shadow.extend(bytes(end - len(shadow)))
+            shadow[2*start_addr:end] = data
+            self.shadow[channel] = shadow
+
+    def write_channel(self, channel, data):
+        """Write a channel memory image.
+
+        If :attr:`differential` is enabled and the previous content of the
+        channel memory is known, only the changed address ranges are
+        written (see :func:`changed_ranges`).
+
+        Args:
+            channel (int): Channel index to write to.
+            data (bytes): Memory image starting at address zero.
+        """
+        return self._send(self._write_channel(channel, data))
+
+    def _write_channel(self, channel, data):
+        shadow = self.shadow[channel]
+        if not self.differential:
+            yield from self._write_mem(channel, data)
+        elif shadow is None:
+            yield from self._write_mem(channel, data)
+            self.shadow[channel] = bytearray(data)
+        else:
+            view = memoryview(data)
+            for start, end in changed_ranges(shadow, data):
+                yield from self._write_mem(channel, view[2*start:2*end],
+                                           start)
+
+    def reset_shadow(self, channels=None):
+        """Forget the shadow copies of the channel memories.
+
+        Required if the channel memories have been modified or lost
+        (e.g. through a power cycle) without this object being aware.
+        The next :meth:`write_channel` will write the complete image.
+
+        Args:
+            channels (list[int]): Channel indices. If unspecified, all
+                channels are reset.
+        """
+        if channels is None:
+            channels = range(self.num_channels)
+        for channel in channels:
+            self.shadow[channel] = None
+
+    def load_image(self, image, channels=None):
+        """Write a precompiled stack image.
+
+        The channel memory images are written without recompilation and
+        the :class:`Channel` are restored from them (see
+        :meth:`Channel.load`) so that frames can be updated afterwards.
+        The layout of the image must match the stack and the image must be
+        intact (see :meth:`host.image.StackImage.verify`).
+
+        Args:
+            image (host.image.StackImage): Stack image.
+            channels (list[int]): Channel indices to write. If unspecified,
+                all channels in the image are written.
+        """
+        if (image.num_boards != self.num_boards or
+                image.num_dacs != self.num_dacs or
+                image.num_frames != Channel.num_frames):
+            raise ValueError("stack image layout mismatch")
+        if not image.verify():
+            raise ValueError("stack image corrupted")
+        if channels is None:
+            channels = image.channels
+        return self._send(self._load_image(image, channels))
+
+    def _load_image(self, image, channels):
+        for channel in channels:
+            data = image.image(channel)
+            self.channels[channel].load(data)
+            yield from self._write_channel(channel, data)
+
+    def budget(self, program, channels=None):
+        """Estimate the memory usage of a wavesynth program.
+
+        A fast sizing pass that does not compile the program. See
+        :func:`frame_words`. Segments with identical data share memory
+        (see :meth:`Channel.place`); the estimate is exact if there are
+        none and an upper bound otherwise.
+
+        Args:
+            program (list): Wavesynth program (list of frames).
+            channels (list[int]): Channel indices to use. If unspecified, all
+                channels are used.
+
+        Returns:
+            words (array[int]): Number of words for each channel and frame,
+                shape ``(channels, frames)``.
+            headroom (array[int]): Number of words left on each channel.
+                Negative if the program does not fit.
+        """
+        if channels is None:
+            channels = range(self.num_channels)
+        n = len(channels)
+        words = np.array([frame_words(frame, n) for frame in program],
+                         int).reshape(-1, n).T
+        headroom = np.array([
+            self.channels[i].max_data - self.channels[i].num_frames
+            for i in channels], int) - words.sum(1)
+        return words, headroom
 
     def program_segments(self, segments, data):
         """Append the wavesynth lines to the given segments.
 
         Args:
             segments (list[Segment]): List of :class:`Segment` to append the
-                lines to.
+                lines to. ``None`` entries are skipped.
             data (list): List of wavesynth lines.
         """
         for i, line in enumerate(data):
-            dac_divider = line.get("dac_divider", 1)
-            shift = int(log(dac_divider, 2))
-            if 2**shift != dac_divider:
-                raise ValueError("only power-of-two dac_dividers supported")
+            dac_divider = integer_divider(line.get("dac_divider", 1))
+            shift = dac_divider.bit_length() - 1
             duration = line["duration"]
             trigger = line.get("trigger", False)
+            split = (1 << shift != dac_divider or shift > 15 or
+                     not 0 <= duration < Segment.max_time)
             for segment, data in zip(segments, line["channel_data"]):
+                if segment is None:
+                    continue
                 if len(data) != 1:
                     raise ValueError("only one target per channel and line "
                                      "supported")
                 for target, target_data in data.items():
-                    getattr(segment, target)(
-                        shift=shift, duration=duration, trigger=trigger,
-                        **target_data)
+                    if split:
+                        self._program_split(segment, target, duration,
+                                            dac_divider, trigger,
+                                            target_data)
+                    else:
+                        getattr(segment, target)(
+                            shift=shift, duration=duration, trigger=trigger,
+                            **target_data)
+
+    @staticmethod
+    def _program_split(segment, target, duration, dac_divider, trigger,
+                       data):
+        # a line that needs to be split, see split_line()
+        data = dict(data)
+        amplitude = data.pop("amplitude", [])
+        phase = data.pop("phase", [])
+        clear = data.pop("clear", False)
+        lines = split_line(duration, amplitude, phase, dac_divider)
+        for j, (duration, shift, amplitude, phase) in enumerate(lines):
+            if phase:
+                data["phase"] = phase
+            getattr(segment, target)(
+                shift=shift, duration=duration, trigger=trigger and not j,
+                clear=clear and not j, amplitude=amplitude, **data)
+
+    def program_frame(self, segments, frame):
+        """Append a wavesynth frame to the given segments.
+
+        Short single-cycle lines are prepended and appended to the frame to
+        allow proper write interlocking and to assure that the memory reader
+        can be reliably parked in the frame address table.
+        The first line of each frame is mandatorily triggered.
+
+        Args:
+            segments (list[Segment]): List of :class:`Segment` to append the
+                frame to. ``None`` entries are skipped.
+            frame (list): List of wavesynth lines or columnar frame (see
+                :mod:`host.wavesynth`).
+        """
+        active = [segment for segment in segments if segment is not None]
+        for segment in active:
+            segment.line(typ=3, data=b"", trigger=True, duration=1, aux=1)
+        if is_columnar(frame):
+            for segment, lines in zip(segments, frame):
+                if segment is not None:
+                    segment.extend(lines)
+        else:
+            self.program_segments(segments, frame)
+        # append an empty line to stall the memory reader before jumping
+        # through the frame table (`wait` does not prevent reading
+        # the next line)
+        for segment in active:
+            segment.line(typ=3, data=b"", trigger=True, duration=1, aux=1,
+                         jump=True)
+
+    def _compile_frame(self, segments, frame):
+        if self.cache is None or not _reiterable(frame):
+            # frames given as iterators are compiled in a single pass
+            self.program_frame(segments, frame)
+        else:
+            self._program_cached(segments, frame)
 
-    def program(self, program, channels=None):
+    def _program_cached(self, segments, frame):
+        params = Segment.out_scale, Segment.cordic_gain
+        keys = [self.cache.key(frame, i, *params)
+                if segment is not None else None
+                for i, segment in enumerate(segments)]
+        todo = list(segments)
+        for i, key in enumerate(keys):
+            if key is None:
+                continue
+            data = self.cache.get(key)
+            if data is not None:
+                segments[i]._append(data)
+                todo[i] = None
+        if all(segment is None for segment in todo):
+            return
+        self.program_frame(todo, frame)
+        for key, segment in zip(keys, todo):
+            if segment is not None:
+                self.cache.put(key, segment.data)
+
+    def _compile(self, program, chs):
+        # frame-major compilation in a single pass over the program
+        # `None` channels are skipped
+        for channel in chs:
+            if channel is not None:
+                channel.clear()
+        for frame in program:
+            segments = [c.new_segment() if c is not None else None
+                        for c in chs]
+            self._compile_frame(segments, frame)
+
+    def _compile_disk_cached(self, program, channels):
+        # channel images from the disk cache, compile the others
+        params = (Segment.out_scale, Segment.cordic_gain, Channel.num_frames,
+                  FORMAT_VERSION)
+        keys = [self.disk_cache.key(program, i, *params)
+                for i in range(len(channels))]
+        data = [self.disk_cache.get(key) for key in keys]
+        chs = [self.channels[channel] if d is None else None
+               for channel, d in zip(channels, data)]
+        if any(ch is not None for ch in chs):
+            self._compile(program, chs)
+        for channel, key, d, ch in zip(channels, keys, data, chs):
+            if ch is None:
+                self.channels[channel].load(d)
+            else:
+                d = ch.serialize()
+                self.disk_cache.put(key, d)
+            yield channel, d
+
+    def _compile_channels(self, program, channels):
+        # channel-major compilation, yields channel images
+        chs = [self.channels[i] for i in channels]
+        if not (_reiterable(program) and
+                all(_reiterable(frame) for frame in program)):
+            # iterators can only be traversed once
+            self._compile(program, chs)
+            for channel, ch in zip(channels, chs):
+                yield channel, ch.serialize()
+            return
+        for i, (channel, ch) in enumerate(zip(channels, chs)):
+            ch.clear()
+            segments = [None] * len(chs)
+            for frame in program:
+                segments[i] = ch.new_segment()
+                self._compile_frame(segments, frame)
+            yield channel, ch.serialize()
+
+    def _write_pipelined(self, items, depth=2):
+        # iterate over items in this thread, write them in another
+        queue = Queue(depth)
+        state = {"error": None, "abort": False}
+
+        def writer():
+            while True:
+                item = queue.get()
+                if item is None:
+                    return
+                if state["error"] is not None or state["abort"]:
+                    continue
+                try:
+                    self.write_channel(*item)
+                except BaseException as e:
+                    state["error"] = e
+
+        thread = threading.Thread(target=writer, name="pdq2-writer",
+                                  daemon=True)
+        thread.start()
+        try:
+            for item in items:
+                if state["error"] is not None:
+                    break
+                queue.put(item)
+        except BaseException:
+            state["abort"] = True
+            raise
+        finally:
+            queue.put(None)
+            thread.join()
+        if state["error"] is not None:
+            raise state["error"]
+
+    def compile(self, program, channels=None):
+        """Compile a wavesynth program without writing it.
+
+        The channels are compiled as by :meth:`program` and hold the
+        compiled segments afterwards.
+
+        Args:
+            program (list): Wavesynth program (list of frames).
+            channels (list[int]): Channel indices to use. If unspecified, all
+                channels are used.
+
+        Returns:
+            images (list[tuple[int, bytearray]]): Channel indices and their
+                memory images (see :meth:`Channel.serialize`).
+        """
+        if channels is None:
+            channels = range(self.num_channels)
+        return list(self._compile_channels(program, channels))
+
+    def program(self, program, channels=None, pipeline=False,
+                executor=None):
         """Serialize a wavesynth program and write it to the channels
         in the stack.
 
@@ -363,31 +1445,155 @@ class Pdq2:
         is generated, the channels are serialized and their memories are
         written.
 
-        Short single-cycle lines are prepended and appended to each frame to
-        allow proper write interlocking and to assure that the memory reader
-        can be reliably parked in the frame address table.
-        The first line of each frame is mandatorily triggered.
+        See :meth:`program_frame` for the lines added to each frame.
+
+        Frames can also be given in the columnar format (see
+        :mod:`host.wavesynth`). They are compiled with vectorized array
+        operations (see :meth:`Segment.extend`). Columnar lines are not
+        split, see :data:`host.wavesynth.line_dtype`.
+
+        The program and its frames can be given as iterators (e.g.
+        generators of frames and lines). They are then compiled in a
+        single pass and only the compiled segments are held in memory.
+
+        If a :attr:`cache` is configured, the segments of frames whose
+        lines are unchanged on a channel are taken from the cache and only
+        the remaining frames are compiled. Frames given as iterators are
+        not cached.
+
+        If ``pipeline`` is enabled, the channels are compiled one after the
+        other and each channel is written by a background thread while the
+        next channel is being compiled. The data written is identical.
+        If the program or its frames are iterators, all channels are
+        compiled before writing starts.
+        Errors in the writer thread are raised in the calling thread.
+
+        If an ``executor`` is given, the channels are compiled in parallel on
+        it (see :func:`host.parallel.compile_channels`). The data written is
+        identical. If the executor is unavailable, the channels are compiled
+        serially.
+
+        If a :attr:`disk_cache` is configured, the memory images of the
+        channels are looked up by the hash of their lines and the compile
+        parameters. Only the channels that are not in the cache are
+        compiled (serially) and their images are stored. Programs given as
+        iterators are not cached.
 
         Args:
             program (list): Wavesynth program to serialize.
             channels (list[int]): Channel indices to use. If unspecified, all
                 channels are used.
+            pipeline (bool): Overlap compilation and writing.
+            executor (concurrent.futures.Executor): Executor to compile
+                channels on, e.g. a
+                :class:`concurrent.futures.ProcessPoolExecutor`.
         """
         if channels is None:
             channels = range(self.num_channels)
+        if self.disk_cache is not None and _reiterable(program) and all(
+                _reiterable(frame) for frame in program):
+            items = self._compile_disk_cached(program, channels)
+        elif executor is not None:
+            from .parallel import compile_channels
+            items = compile_channels(self, program, channels, executor)
+        elif pipeline:
+            items = self._compile_channels(program, channels)
+        else:
+            return self._send(self._program(program, channels))
+        if pipeline:
+            self._write_pipelined(items)
+            return
+        return self._send(self._write_channels(items))
+
+    def _write_channels(self, items):
+        for channel, data in items:
+            yield from self._write_channel(channel, data)
+
+    def _program(self, program, channels):
         chs = [self.channels[i] for i in channels]
-        for channel in chs:
-            channel.clear()
-        for frame in program:
-            segments = [c.new_segment() for c in chs]
-            for segment in segments:
-                segment.line(typ=3, data=b"", trigger=True, duration=1, aux=1)
-            self.program_segments(segments, frame)
-            # append an empty line to stall the memory reader before jumping
-            # through the frame table (`wait` does not prevent reading
-            # the next line)
-            for segment in segments:
-                segment.line(typ=3, data=b"", trigger=True, duration=1, aux=1,
-                             jump=True)
+        self._compile(program, chs)
         for channel, ch in zip(channels, chs):
-            self.write_mem(channel, ch.serialize())
+            yield from self._write_channel(channel, ch.serialize())
+
+    def update_frame(self, frame_index, frame, channels=None):
+        """Serialize a single wavesynth frame and replace it on the
+        channels in the stack.
+
+        Only the new frame is compiled. Its segments are allocated in free
+        memory (see :meth:`Channel.update`) and written. Then the frame
+        address table entries are switched to the new segments. The other
+        frames and their memory are not touched. If the frame can not be
+        allocated on all channels, nothing is changed or written.
+
+        The channels need to have been programmed with :meth:`program`
+        before.
+
+        Args:
+            frame_index (int): Index of the frame to replace.
+            frame (list): Wavesynth frame (list of lines).
+            channels (list[int]): Channel indices to use. If unspecified, all
+                channels are used.
+        """
+        if channels is None:
+            channels = range(self.num_channels)
+        return self._send(self._update_frame(frame_index, frame, channels))
+
+    def _update_frame(self, frame_index, frame, channels):
+        chs = [self.channels[i] for i in channels]
+        segments = [Segment() for c in chs]
+        self._compile_frame(segments, frame)
+        # allocate on all channels before anything is written
+        states = [ch._save() for ch in chs]
+        try:
+            new = [ch.update(frame_index, segment)
+                   for ch, segment in zip(chs, segments)]
+        except AllocationError:
+            for ch, state in zip(chs, states):
+                ch._restore(state)
+            raise
+        for channel, segment, n in zip(channels, segments, new):
+            if n:
+                yield from self._write_mem(channel, segment.data,
+                                           segment.addr)
+        for channel, segment in zip(channels, segments):
+            yield from self._write_mem(
+                channel, struct.pack("<H", segment.addr), frame_index)
+
+    def remove_frame(self, frame_index, channels=None):
+        """Remove a frame from the channels in the stack.
+
+        The frame address table entry is cleared and the frame memory is
+        released for later :meth:`update_frame`.
+
+        Args:
+            frame_index (int): Index of the frame to remove.
+            channels (list[int]): Channel indices to use. If unspecified, all
+                channels are used.
+        """
+        if channels is None:
+            channels = range(self.num_channels)
+        return self._send(self._remove_frame(frame_index, channels))
+
+    def _remove_frame(self, frame_index, channels):
+        for channel in channels:
+            self.channels[channel].remove(frame_index)
+            yield from self._write_mem(channel, struct.pack("<H", 0),
+                                       frame_index)
+
+    def compact(self, channels=None):
+        """Compact and rewrite the channel memories.
+
+        See :meth:`Channel.compact`.
+
+        Args:
+            channels (list[int]): Channel indices to use. If unspecified, all
+                channels are used.
+        """
+        if channels is None:
+            channels = range(self.num_channels)
+        return self._send(self._compact(channels))
+
+    def _compact(self, channels):
+        for channel in channels:
+            yield from self._write_channel(channel,
+                                           self.channels[channel].compact())
@@ -0,0 +1,124 @@
+# Copyright 2013-2015 Robert Jordens <jordens@gmail.com>
+#
+# This file is part of pdq2.
+#
+# pdq2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pdq2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pdq2.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Upload instrumentation.
+
+An :class:`UploadStats` passed to :class:`host.pdq2.Pdq2` as ``stats``
+accounts for the data written to the stack.
+"""
+
+
+class UploadStats:
+    """Counters and latency histogram of the data written to a stack.
+
+    Memory write latencies are binned logarithmically: bin ``0`` counts
+    latencies below one microsecond, bin ``k`` latencies from ``2**(k -
+    1)`` to ``2**k`` microseconds. The last bin also counts all longer
+    latencies.
+
+    Args:
+        callback (callable): Called after each device write with the number
+            of bytes written and the duration of the write in seconds.
+        bins (int): Number of latency histogram bins.
+
+    Attributes:
+        payload_bytes (int): Memory write bytes (headers and data) before
+            escaping.
+        escape_bytes (int): Escape characters added to the memory writes.
+        bytes_written (int): Bytes written to the device, including
+            commands.
+        commands (int): Number of commands.
+        write_calls (int): Number of device writes.
+        write_time (float): Time spent in device writes in seconds.
+        mem_writes (int): Number of memory writes.
+        mem_time (float): Total duration of the memory writes in seconds.
+            Includes escaping and waiting for the device.
+        latency (list[int]): Memory write latency histogram.
+    """
+    def __init__(self, callback=None, bins=32):
+        self.callback = callback
+        self.bins = bins
+        self.reset()
+
+    def reset(self):
+        """Clear all counters."""
+        self.payload_bytes = 0
+        self.escape_bytes = 0
+        self.bytes_written = 0
+        self.commands = 0
+        self.write_calls = 0
+        self.write_time = 0.
+        self.mem_writes = 0
+        self.mem_time = 0.
+        self.latency = [0] * self.bins
+
+    def write(self, size, duration):
+        """Account for a device write.
+
+        Args:
+            size (int): Number of bytes written.
+            duration (float): Duration of the write in seconds.
+        """
+        self.write_calls += 1
+        self.bytes_written += size
+        self.write_time += duration
+        if self.callback is not None:
+            self.callback(size, duration)
+
+    def mem_write(self, payload, size, duration):
+        """Account for a memory write.
+
+        Args:
+            payload (int): Number of bytes before escaping.
+            size (int): Number of bytes after escaping.
+            duration (float): Duration of the memory write in seconds.
+        """
+        self.mem_writes += 1
+        self.payload_bytes += payload
+        self.escape_bytes += size - payload
+        self.mem_time += duration
+        k = min(int(duration*1e6).bit_length(), self.bins - 1)
+        self.latency[k] += 1
+
+    @property
+    def throughput(self):
+        """Effective memory write throughput in payload bytes per second."""
+        if not self.mem_time:
+            return 0.
+        return self.payload_bytes/self.mem_time
+
+    def as_dict(self):
+        """Export the counters.
+
+        Returns:
+            stats (dict): The attributes and the ``throughput``. The latency
+                histogram is given as ``latency`` (list of counts) and
+                ``latency_edges`` (upper bin edges in seconds).
+        """
+        return {
+            "payload_bytes": self.payload_bytes,
+            "escape_bytes": self.escape_bytes,
+            "bytes_written": self.bytes_written,
+            "commands": self.commands,
+            "write_calls": self.write_calls,
+            "write_time": self.write_time,
+            "mem_writes": self.mem_writes,
+            "mem_time": self.mem_time,
+            "throughput": self.throughput,
+            "latency": list(self.latency),
+            "latency_edges": [2**k*1e-6 for k in range(self.bins)],
+        }
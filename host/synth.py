@@ -0,0 +1,286 @@
+# Copyright 2013-2015 Robert Jordens <jordens@gmail.com>
+#
+# This file is part of pdq2.
+#
+# pdq2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pdq2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pdq2.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Bit-exact NumPy model of the channel output gateware.
+
+Models :class:`gateware.dac.Dac` (without FIFO): the memory
+:class:`gateware.dac.Parser`, the :class:`gateware.dac.Sequencer` with its
+duration and ``2**shift`` counters, the :class:`gateware.dac.Volt` and
+:class:`gateware.dac.Dds` spline interpolators with their wrapping
+accumulators, and the pipelined :class:`gateware.cordic.Cordic`.
+
+The line timing is determined line by line. The accumulators are then
+evaluated for all clock cycles at once with array operations.
+"""
+
+from math import atan, pi
+
+import numpy as np
+
+
+#: Number of CORDIC stages.
+cordic_stages = 17
+#: CORDIC guard bits.
+cordic_guard = 4
+#: CORDIC elementary rotation angles.
+cordic_angles = [round(atan(2**-i)*2**19/pi) for i in range(cordic_stages)]
+
+
+def _wrap(v, bits):
+    # two's complement wrap to a signed value
+    return ((v + (1 << bits - 1)) & ((1 << bits) - 1)) - (1 << bits - 1)
+
+
+def cordic(xi, zi):
+    """Bit-exact model of the DDS CORDIC.
+
+    Four-quadrant circular rotation with ``width=16``, ``guard=4`` and
+    ``yi=0`` as used in :class:`gateware.dac.Dds`. Pipeline latency is not
+    modelled.
+
+    Args:
+        xi (array[int16]): Amplitude input.
+        zi (array[int16]): Phase input (``1 << 15`` corresponds to ``pi``).
+
+    Returns:
+        xo (array[int16]): Amplitude output.
+    """
+    xi = np.asarray(xi, np.int64)
+    zi = np.asarray(zi, np.int64)
+    # quadrant remapping
+    q = ((zi >> 14) ^ (zi >> 15)) & 1 == 1
+    xi = np.where(q, _wrap(-xi, 16), xi)
+    zi = np.where(q, _wrap(zi + (1 << 15), 16), zi)
+    bits = 16 + cordic_guard
+    x = xi << cordic_guard
+    y = np.zeros_like(x)
+    z = zi << cordic_guard
+    for i, a in enumerate(cordic_angles):
+        d = z < 0
+        dx = y >> i
+        dy = x >> i
+        x, y, z = (_wrap(np.where(d, x + dx, x - dx), bits),
+                   _wrap(np.where(d, y - dy, y + dy), bits),
+                   _wrap(np.where(d, z + a, z - a), bits))
+    return (x >> cordic_guard).astype(np.int16)
+
+
+def _binom(m, k):
+    # binomial coefficient modulo 2**64
+    m = np.asarray(m, np.uint64)
+    if k == 0:
+        return np.ones_like(m)
+    f = [m - np.uint64(i) for i in range(k)]
+    for div in range(k, 1, -1):
+        done = np.zeros(m.shape, bool)
+        for i in range(k):
+            sel = ~done & (f[i] % np.uint64(div) == 0)
+            f[i] = np.where(sel, f[i]//np.uint64(div), f[i])
+            done |= sel
+    r = np.where(m >= k, np.uint64(1), np.uint64(0))
+    for fi in f:
+        r = r*fi
+    return r
+
+
+def _words(data, start, n):
+    # little-endian concatenation of n data words
+    v = np.zeros(len(data), np.uint64)
+    for i in range(n):
+        v |= data[:, start + i].astype(np.uint64) << np.uint64(16*i)
+    return v
+
+
+def _evolve(state, m, bits):
+    # value of the first accumulator after m increments
+    mask = np.uint64((1 << bits) - 1)
+    v = np.zeros(np.shape(m), np.uint64)
+    for k, s in enumerate(state):
+        v += _binom(m, k)*s
+    return v & mask
+
+
+def spline(data, steps):
+    """Amplitude output of the :class:`gateware.dac.Volt` and
+    :class:`gateware.dac.Dds` spline interpolators.
+
+    Args:
+        data (array[uint16]): Line data words (see
+            :meth:`host.pdq2.Segment.pack_array`). One row per evaluation
+            or a single row. Missing words are zero.
+        steps (array[int]): Number of accumulator increments since the line
+            data was loaded.
+
+    Returns:
+        amplitude (array[int16]): Amplitude output.
+    """
+    data = np.atleast_2d(np.asarray(data, np.uint16))
+    if data.shape[1] < 9:
+        data = np.hstack([data, np.zeros((len(data), 9 - data.shape[1]),
+                                         np.uint16)])
+    steps = np.asarray(steps, np.uint64) + np.zeros(len(data), np.uint64)
+    state = [_words(data, 0, 1) << np.uint64(32),
+             _words(data, 1, 2) << np.uint64(16),
+             _words(data, 3, 3), _words(data, 6, 3)]
+    v = _evolve(state, steps, 48) >> np.uint64(32)
+    return v.astype(np.uint16).view(np.int16)
+
+
+class Timeline:
+    """Line timing of a channel.
+
+    Determined by modelling the :class:`gateware.dac.Parser` and
+    :class:`gateware.dac.Sequencer` state machines line by line.
+
+    Args:
+        mem (array[uint16]): Channel memory.
+        frame (int): Selected frame.
+        cycles (int): Number of clock cycles.
+        trigger (array[bool]): Trigger input for each cycle. If ``None``,
+            the trigger is always asserted.
+
+    Attributes:
+        stb (array[int]): Cycles at which lines are started.
+        addr (array[int]): Addresses of the lines started.
+        lines (array[uint16]): Header, duration and 14 data words of each
+            line started.
+        inc (array[int]): Cycles with the accumulator increment enabled.
+    """
+    def __init__(self, mem, frame=0, cycles=1 << 16, trigger=None):
+        mem = np.asarray(mem, np.uint16)
+        self.mem = np.r_[mem, np.zeros(16, np.uint16)]
+        self.cycles = cycles
+        if trigger is None:
+            trigger = np.ones(cycles, bool)
+        trigger = np.asarray(trigger, bool)[:cycles]
+        self._triggers = np.flatnonzero(trigger)
+        stb, addr, inc = [], [], [np.array([0])]
+        # parser: JUMP at cycle 0, FRAME at 1, HEADER at 2
+        a = int(self.mem[frame])
+        avail = self._avail(a, 2)
+        # sequencer: idle, toc0 is reset
+        ready, stall, wait = 0, True, False
+        while avail is not None:
+            header = int(self.mem[a])
+            if wait or header & (1 << 6):
+                c = self._next_trigger(max(ready, avail))
+            else:
+                c = max(ready, avail)
+            if c >= cycles:
+                break
+            if stall and c > ready:
+                inc.append(np.array([ready]))
+            stb.append(c)
+            addr.append(a)
+            length = header & 0xf
+            shift = (header >> 9) & 0xf
+            n = ((int(self.mem[a + 1]) - 1) & 0xffff) + 1
+            inc.append(c + (np.arange(1, n) << shift))
+            ready = c + (n << shift)
+            stall = shift == 0 and n >= 2
+            wait = bool(header & (1 << 15))
+            if header & (1 << 13):
+                a = int(self.mem[frame])
+                avail = self._avail(a, c + 3)
+            else:
+                a += 1 + length
+                avail = self._avail(a, c + 1)
+        if stall and ready < cycles:
+            inc.append(np.array([ready]))
+        self.stb = np.array(stb, int)
+        self.addr = np.array(addr, int)
+        self.lines = self.mem[self.addr[:, None] + np.arange(16)]
+        self.lines[np.arange(16) > self.lines[:, :1] & 0xf] = 0
+        inc = np.concatenate(inc)
+        self.inc = inc[inc < cycles]
+
+    def _avail(self, a, header):
+        # cycle at which the parser presents the line at address a after
+        # entering HEADER at cycle `header`
+        if not a:
+            return None
+        length = int(self.mem[a]) & 0xf
+        if not length:
+            raise ValueError("zero length line at {}".format(a))
+        return header + 1 + length
+
+    def _next_trigger(self, cycle):
+        i = np.searchsorted(self._triggers, cycle)
+        if i == len(self._triggers):
+            return self.cycles
+        return int(self._triggers[i])
+
+
+def synthesize(mem, frame=0, cycles=1 << 16, trigger=None):
+    """Compute the output samples of a channel.
+
+    Args:
+        mem (bytes): Channel memory image (e.g. as returned by
+            :meth:`host.pdq2.Channel.serialize`) or array of words.
+        frame (int): Selected frame. Arm and start are asserted.
+        cycles (int): Number of clock cycles to compute.
+        trigger (array[bool]): Trigger input for each cycle. If ``None``,
+            the trigger is always asserted.
+
+    Returns:
+        out (array[int16]): DAC output data for each cycle.
+    """
+    if not isinstance(mem, np.ndarray):
+        mem = np.frombuffer(mem, "<u2")
+    t = Timeline(mem, frame, cycles, trigger)
+    k = np.arange(cycles)
+    # increments before each cycle
+    before = np.searchsorted(t.inc, k)
+    typ = (t.lines[:, 0] >> 4) & 3
+    data = t.lines[:, 2:]
+
+    def segments(sel):
+        # index of the last load before each cycle and increments since
+        loads = t.stb[sel]
+        idx = np.searchsorted(loads, k) - 1
+        base = np.r_[0, np.searchsorted(t.inc, loads + 1)][idx + 1]
+        return idx, np.where(idx >= 0, before - base, 0).astype(np.uint64)
+
+    volt = typ == 0
+    idx, m = segments(volt)
+    d = np.r_[np.zeros((1, 14), np.uint16), data[volt]]
+    out = spline(d[idx + 1], m).view(np.uint16)
+
+    dds = typ == 1
+    idx, m = segments(dds)
+    d = data[dds]
+    xi = spline(np.r_[np.zeros((1, 14), np.uint16), d][idx + 1], m)
+    z0 = np.r_[np.uint64(0), _words(d, 9, 1)][idx + 1]
+    z1 = np.r_[np.uint64(0), _words(d, 10, 2)][idx + 1]
+    z2 = np.r_[np.uint64(0), _words(d, 12, 2)][idx + 1]
+    z1 = (z1 + m*z2) & np.uint64(0xffffffff)
+    # phase accumulator, cleared by dds lines with the clear flag
+    za = np.zeros(cycles + 1, np.uint64)
+    np.cumsum(z1, out=za[1:])
+    clear = t.stb[dds & ((t.lines[:, 0] >> 14) & 1 == 1)] + 1
+    clear = clear[clear <= cycles]
+    last = np.searchsorted(clear, k, side="right")
+    za = za[:cycles] - za[np.r_[0, clear][last]]
+    zi = ((za >> np.uint64(16)) + z0) & np.uint64(0xffff)
+    # the cordic output vanishes with the amplitude
+    nz = np.flatnonzero(xi[:cycles - cordic_stages])
+    xo = cordic(xi[nz], zi[nz].astype(np.uint16).view(np.int16))
+    # pipeline latency
+    out[nz + cordic_stages] += xo.view(np.uint16)
+    # output register
+    out = np.r_[np.uint16(0), out[:-1]]
+    return out.view(np.int16)
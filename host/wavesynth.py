@@ -0,0 +1,228 @@
+# Copyright 2013-2015 Robert Jordens <jordens@gmail.com>
+#
+# This file is part of pdq2.
+#
+# pdq2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pdq2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pdq2.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+
+
+#: Columnar wavesynth line format.
+#:
+#: * ``duration``: Line duration in units of ``2**shift`` clock cycles.
+#:   Columnar lines are not split (see :func:`host.pdq2.split_line`): the
+#:   duration is limited to ``2**16 - 1`` steps and the ``dac_divider`` to
+#:   powers of two.
+#: * ``shift``: ``log2(dac_divider)``.
+#: * ``trigger``, ``silence``, ``clear``: Line flags.
+#: * ``typ``: Target, ``0`` for ``bias``, ``1`` for ``dds``.
+#: * ``amplitude``: Amplitude coefficients, zero-padded.
+#: * ``amplitude_len``: Number of amplitude coefficients.
+#: * ``phase``: Phase coefficients (``dds`` only), zero-padded.
+#: * ``phase_len``: Number of phase coefficients.
+line_dtype = np.dtype([
+    ("duration", "<u2"),
+    ("shift", "u1"),
+    ("trigger", "?"),
+    ("silence", "?"),
+    ("clear", "?"),
+    ("typ", "u1"),
+    ("amplitude_len", "u1"),
+    ("phase_len", "u1"),
+    ("amplitude", "<f8", (4,)),
+    ("phase", "<f8", (3,)),
+])
+
+targets = ["bias", "dds"]
+
+
+def integer_divider(dac_divider):
+    """Validate a ``dac_divider``.
+
+    Args:
+        dac_divider (int): Clock cycles per time step. Integral floats are
+            accepted.
+
+    Returns:
+        dac_divider (int): The divider as an integer.
+    """
+    if dac_divider < 1 or dac_divider != int(dac_divider):
+        raise ValueError("dac_divider must be a positive integer")
+    return int(dac_divider)
+
+
+def is_columnar(frame):
+    """Determine whether a frame is in the columnar format.
+
+    A columnar frame is either a structured array of :data:`line_dtype`
+    with shape ``(channels, lines)`` or a sequence of one-dimensional
+    structured arrays, one per channel. The channels may have different
+    numbers of lines.
+
+    Args:
+        frame: Wavesynth frame.
+
+    Returns:
+        columnar (bool): Whether ``frame`` is a columnar frame.
+    """
+    if isinstance(frame, np.ndarray):
+        return True
+    return (isinstance(frame, (list, tuple)) and len(frame) > 0 and
+            isinstance(frame[0], np.ndarray))
+
+
+def frame_from_dicts(frame, num_channels=None):
+    """Convert a wavesynth frame to the columnar format.
+
+    Lines without data for a channel (a ``channel_data`` with fewer
+    entries) are skipped on that channel, as they are when the frame is
+    compiled. The channels then have different numbers of lines.
+
+    Lines that would need to be split (durations of ``2**16`` steps or
+    more, ``dac_divider`` not a power of two) are not supported. Program
+    such frames in the dictionary format.
+
+    Args:
+        frame (list): Wavesynth frame (list of line dictionaries).
+        num_channels (int): Number of channels. Defaults to the largest
+            number of entries in the ``channel_data`` of the lines.
+
+    Returns:
+        frame (array[line_dtype]): Columnar frame with shape
+            ``(channels, lines)`` if all lines have data for all channels,
+            otherwise a list of one-dimensional arrays, one per channel.
+    """
+    frame = list(frame)
+    if num_channels is None:
+        num_channels = max((len(line["channel_data"]) for line in frame),
+                           default=0)
+    out = np.zeros((num_channels, len(frame)), line_dtype)
+    present = np.zeros(out.shape, bool)
+    for j, line in enumerate(frame):
+        dac_divider = integer_divider(line.get("dac_divider", 1))
+        shift = dac_divider.bit_length() - 1
+        if 1 << shift != dac_divider:
+            raise ValueError("only power-of-two dac_dividers supported")
+        if shift > 15:
+            raise ValueError("dac_divider out of range")
+        duration = line["duration"]
+        if not 0 <= duration < 1 << 16:
+            raise ValueError("duration out of range, columnar lines "
+                             "are not split")
+        trigger = line.get("trigger", False)
+        for i, data in enumerate(line["channel_data"][:num_channels]):
+            if len(data) != 1:
+                raise ValueError("only one target per channel and line "
+                                 "supported")
+            (target, target_data), = data.items()
+            unknown = set(target_data) - {"amplitude", "phase", "silence",
+                                          "clear"}
+            if unknown:
+                raise ValueError("unsupported spline data: {}".format(
+                    unknown))
+            present[i, j] = True
+            row = out[i, j]
+            row["duration"] = duration
+            row["shift"] = shift
+            row["trigger"] = trigger
+            row["silence"] = target_data.get("silence", False)
+            row["clear"] = target_data.get("clear", False)
+            row["typ"] = targets.index(target)
+            amplitude = target_data.get("amplitude", [])
+            row["amplitude_len"] = len(amplitude)
+            row["amplitude"][:len(amplitude)] = amplitude
+            phase = target_data.get("phase", [])
+            row["phase_len"] = len(phase)
+            row["phase"][:len(phase)] = phase
+    if not present.all():
+        return [lines[mask] for lines, mask in zip(out, present)]
+    return out
+
+
+def frame_to_dicts(frame):
+    """Convert a columnar frame to the wavesynth format.
+
+    The conversion is lossless up to keys with default values
+    (``trigger``, ``dac_divider``, ``silence``, ``clear``) which are only
+    emitted if they differ from their default, and empty ``amplitude`` and
+    ``phase`` lists, which are omitted.
+
+    Args:
+        frame (array[line_dtype]): Columnar frame. All channels must have
+            the same number of lines with identical ``duration``,
+            ``shift``, and ``trigger``.
+
+    Returns:
+        frame (list): Wavesynth frame (list of line dictionaries).
+    """
+    if not len(frame):
+        return []
+    if len(set(len(lines) for lines in frame)) != 1:
+        raise ValueError("channels differ in number of lines")
+    frame = np.array(list(frame), line_dtype)
+    for field in "duration", "shift", "trigger":
+        if np.any(frame[field] != frame[field][:1]):
+            raise ValueError("channels differ in {}".format(field))
+    out = []
+    for j in range(frame.shape[1]):
+        first = frame[0, j]
+        line = {"duration": int(first["duration"])}
+        if first["shift"]:
+            line["dac_divider"] = 1 << int(first["shift"])
+        if first["trigger"]:
+            line["trigger"] = True
+        line["channel_data"] = channel_data = []
+        for row in frame[:, j]:
+            data = {}
+            if row["amplitude_len"]:
+                data["amplitude"] = row["amplitude"][
+                    :row["amplitude_len"]].tolist()
+            if row["phase_len"]:
+                data["phase"] = row["phase"][:row["phase_len"]].tolist()
+            if row["silence"]:
+                data["silence"] = True
+            if row["clear"]:
+                data["clear"] = True
+            channel_data.append({targets[row["typ"]]: data})
+        out.append(line)
+    return out
+
+
+def from_dicts(program, num_channels=None):
+    """Convert a wavesynth program to the columnar format.
+
+    See :func:`frame_from_dicts`.
+
+    Args:
+        program (list): Wavesynth program (list of frames).
+        num_channels (int): Number of channels.
+
+    Returns:
+        program (list[array[line_dtype]]): Columnar frames.
+    """
+    return [frame_from_dicts(frame, num_channels) for frame in program]
+
+
+def to_dicts(program):
+    """Convert a columnar program to the wavesynth format.
+
+    See :func:`frame_to_dicts`.
+
+    Args:
+        program (list[array[line_dtype]]): Columnar frames.
+
+    Returns:
+        program (list): Wavesynth program (list of frames).
+    """
+    return [frame_to_dicts(frame) for frame in program]
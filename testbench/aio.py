@@ -0,0 +1,87 @@
+# Copyright 2013-2015 Robert Jordens <jordens@gmail.com>
+#
+# This file is part of pdq2.
+#
+# pdq2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pdq2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pdq2.  If not, see <http://www.gnu.org/licenses/>.
+
+# The stream written by host.aio is identical to the one of host.pdq2
+
+import asyncio
+from io import BytesIO
+
+from host.aio import AsyncPdq2
+from host.bench import synthetic_program
+from host.pdq2 import Pdq2
+
+
+class BufferingWriter:
+    # like a transport below its high-water mark: the data objects are
+    # kept and only sent later
+    def __init__(self, high_water=1 << 16):
+        self.high_water = high_water
+        self.pending = []
+        self.sent = bytearray()
+        self.closed = False
+
+    def write(self, data):
+        self.pending.append(data)
+
+    def _flush(self):
+        for data in self.pending:
+            self.sent += data
+        self.pending.clear()
+
+    async def drain(self):
+        if sum(len(data) for data in self.pending) > self.high_water:
+            self._flush()
+
+    def close(self):
+        self._flush()
+        self.closed = True
+
+
+async def write_async(program, channels):
+    writer = BufferingWriter()
+    dev = AsyncPdq2(writer)
+    for cmd, enable in ("START", False), ("ARM", True):
+        await dev.cmd(cmd, enable)
+    await dev.program(program, channels)
+    await dev.write_mem(4, bytes(range(256)), 17)
+    await dev.close()
+    assert writer.closed
+    return bytes(writer.sent)
+
+
+def write_sync(program, channels):
+    buf = BytesIO()
+    dev = Pdq2(dev=buf)
+    for cmd, enable in ("START", False), ("ARM", True):
+        dev.cmd(cmd, enable)
+    dev.program(program, channels)
+    dev.write_mem(4, bytes(range(256)), 17)
+    return buf.getvalue()
+
+
+def main():
+    program = synthetic_program(lines=30, frames=8, channels=9,
+                                target="dds")
+    channels = range(9)
+    expect = write_sync(program, channels)
+    got = asyncio.run(write_async(program, channels))
+    assert got == expect, (len(got), len(expect))
+    print("{} bytes identical".format(len(got)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+# Copyright 2013-2015 Robert Jordens <jordens@gmail.com>
+#
+# This file is part of pdq2.
+#
+# pdq2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pdq2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pdq2.  If not, see <http://www.gnu.org/licenses/>.
+
+# Channel memory allocation and sharing of identical segments
+
+from io import BytesIO
+import struct
+
+from host.bench import synthetic_program
+from host.pdq2 import AllocationError, Allocator, Channel, Pdq2, Segment
+
+
+def segment(amplitude):
+    segment = Segment()
+    segment.bias(amplitude=[amplitude, 1e-4], duration=10)
+    return segment
+
+
+def check_allocator():
+    a = Allocator(0, 100)
+    assert [a.alloc(n) for n in (10, 20, 5, 30)] == [0, 10, 30, 35]
+    a.free(0, 10)
+    a.free(30, 5)
+    assert a.free_blocks == [(0, 10), (30, 5), (65, 35)]
+    # best fit, not first fit
+    assert a.alloc(4) == 30
+    assert a.alloc(8) == 0
+    assert a.free_blocks == [(8, 2), (34, 1), (65, 35)]
+    # adjacent blocks are merged
+    a.free(10, 20)
+    assert a.free_blocks == [(8, 22), (34, 1), (65, 35)]
+    a.free(30, 4)
+    assert a.free_blocks == [(8, 27), (65, 35)]
+    a.free(0, 8)
+    a.free(35, 30)
+    assert a.free_blocks == [(0, 100)]
+    # fragmented
+    for i in range(10):
+        a.alloc(10)
+    for i in range(0, 100, 20):
+        a.free(i, 10)
+    try:
+        a.alloc(11)
+    except AllocationError as e:
+        assert (e.size, e.available, e.largest) == (11, 50, 10)
+    else:
+        assert False
+    assert a.stats()["fragmentation"] == 1 - 10/50
+    a.claim(45, 3)
+    assert a.free_blocks == [(0, 10), (20, 10), (40, 5), (48, 2), (60, 10),
+                             (80, 10)]
+
+
+def check_sharing():
+    ch = Channel()
+    s = [segment(.1), segment(.1), segment(.2)]
+    assert [ch.allocate(si) for si in s] == [True, False, True]
+    assert s[0].addr == s[1].addr != s[2].addr
+    free = ch.allocator.available()
+    size = len(s[0].data)//2
+    ch.free(s[0])
+    assert ch.allocator.available() == free
+    ch.free(s[1])
+    assert ch.allocator.available() == free + size
+    ch.free(s[2])
+    assert ch.allocator.free_blocks == [(ch.num_frames, ch.max_data -
+                                         ch.num_frames)]
+
+
+def check_load():
+    a, b = segment(.1), segment(.2)
+    n, m = len(a.data)//2, len(b.data)//2
+    ch = Channel()
+    # frames 0 and 1 share their segment, frame 3 has a copy of the data
+    # of frame 2 at a different address
+    table = [8, 8, 8 + n, 8 + n + m] + [0]*(ch.num_frames - 4)
+    ch.load(struct.pack("<8H", *table) + a.data + b.data + b.data)
+    assert ch.entry[0] is ch.entry[1]
+    end = ch.max_data
+    assert ch.allocator.free_blocks == [(8 + n + 2*m, end - 8 - n - 2*m)]
+    ch.remove(3)
+    assert ch.allocator.free_blocks == [(8 + n + m, end - 8 - n - m)]
+    ch.remove(0)
+    assert ch.allocator.free_blocks == [(8 + n + m, end - 8 - n - m)]
+    ch.remove(2)
+    assert ch.allocator.free_blocks == [(8 + n, end - 8 - n)]
+    ch.remove(1)
+    assert ch.allocator.free_blocks == [(8, end - 8)]
+
+
+def check_dedup():
+    a, b = synthetic_program(lines=10, frames=2, channels=2)
+    p = Pdq2(dev=BytesIO(), num_boards=1)
+    p.program([a, b, a, a], [0, 1])
+    for ch in p.channels[:2]:
+        sizes = [len(segment.data)//2 for segment in ch.segments]
+        assert sizes[0] == sizes[2] == sizes[3]
+        assert ch.deduplicated == 2*sizes[0]
+        data = ch.serialize()
+        assert len(data)//2 == ch.num_frames + sizes[0] + sizes[1]
+        addrs = [segment.addr for segment in ch.segments]
+        assert addrs[0] == addrs[2] == addrs[3] != addrs[1]
+    # the frame table points at the shared segment
+    table = p.channels[0].table()
+    assert table[:2] == table[4:6] == table[6:8] != table[2:4]
+
+
+def main():
+    check_allocator()
+    check_sharing()
+    check_load()
+    check_dedup()
+    print("ok")
+
+
+if __name__ == "__main__":
+    main()
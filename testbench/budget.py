@@ -0,0 +1,81 @@
+# Copyright 2013-2015 Robert Jordens <jordens@gmail.com>
+#
+# This file is part of pdq2.
+#
+# pdq2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pdq2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pdq2.  If not, see <http://www.gnu.org/licenses/>.
+
+# The memory budget of host.pdq2 against the compiled channel memories
+
+from io import BytesIO
+
+import numpy as np
+
+from host.bench import synthetic_program
+from host.pdq2 import Pdq2
+from host.wavesynth import from_dicts
+
+
+def check(program, channels=range(3)):
+    p = Pdq2(dev=BytesIO(), num_boards=1)
+    words, headroom = p.budget(program, channels)
+    assert words.shape == (len(channels), len(program))
+    p.program(program, channels)
+    for i, channel in enumerate(channels):
+        ch = p.channels[channel]
+        size = len(ch.serialize())//2
+        assert not ch.deduplicated
+        assert words[i].sum() + ch.num_frames == size, (i, words[i], size)
+        assert headroom[i] == ch.max_data - size
+
+
+def main():
+    rng = np.random.RandomState(0)
+    for order in range(4):
+        for target in "bias", "dds":
+            program = synthetic_program(lines=20, frames=4, order=order,
+                                        target=target, seed=order)
+            check(program)
+            check(from_dicts(program))
+    # lines that are split
+    program = synthetic_program(lines=20, frames=3, order=3)
+    for frame in program:
+        for line in frame:
+            line["duration"] = int(rng.randint(1, 1 << 20))
+            line["dac_divider"] = int(rng.choice([1, 2, 3, 4, 6, 8]))
+            for data in line["channel_data"]:
+                data["bias"]["amplitude"] = data["bias"]["amplitude"][:2]
+                data["bias"]["amplitude"][1] *= 1e-2
+    check(program)
+    program = synthetic_program(lines=10, frames=2, target="dds")
+    for frame in program:
+        for line in frame:
+            line["duration"] = int(rng.randint(1 << 16, 1 << 18))
+            for data in line["channel_data"]:
+                data["dds"]["amplitude"][1:] = [0, 0, 0]
+                data["dds"]["phase"] = data["dds"]["phase"][:2]
+    check(program)
+    # shared segments are counted for every frame
+    program = synthetic_program(lines=10, frames=2)
+    p = Pdq2(dev=BytesIO(), num_boards=1)
+    words, headroom = p.budget(program*2, range(3))
+    p.program(program*2, range(3))
+    for i in range(3):
+        ch = p.channels[i]
+        assert words[i].sum() + ch.num_frames == (
+            len(ch.serialize())//2 + ch.deduplicated)
+    print("ok")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/python3
+# Copyright 2013-2015 Robert Jordens <jordens@gmail.com>
+#
+# This file is part of pdq2.
+#
+# pdq2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pdq2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pdq2.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+
+import numpy as np
+
+from host.pdq2 import Segment
+
+
+def random_lines(n, order, seed=0):
+    rng = np.random.RandomState(seed)
+    duration = rng.randint(1, 1 << 16, n)
+    amplitude = rng.uniform(-1, 1, (n, order + 1))
+    amplitude[:, 1:] *= 10.**-(4*np.arange(1, order + 1))
+    phase = rng.uniform(-.5, .5, (n, 3))
+    phase[:, 1:] *= 1e-3
+    trigger = rng.randint(0, 2, n).astype(bool)
+    return duration, amplitude, phase, trigger
+
+
+def scalar_bias(duration, amplitude, trigger):
+    segment = Segment()
+    for d, a, t in zip(duration, amplitude, trigger):
+        segment.bias(amplitude=[float(ai) for ai in a], duration=int(d),
+                     trigger=bool(t), shift=1)
+    return segment
+
+
+def bulk_bias(duration, amplitude, trigger):
+    segment = Segment()
+    segment.bias_lines(duration, amplitude, trigger=trigger, shift=1)
+    return segment
+
+
+def scalar_dds(duration, amplitude, phase, trigger):
+    segment = Segment()
+    for d, a, p, t in zip(duration, amplitude, phase, trigger):
+        segment.dds(amplitude=[float(ai) for ai in a],
+                    phase=[float(pi) for pi in p], duration=int(d),
+                    trigger=bool(t), clear=True)
+    return segment
+
+
+def bulk_dds(duration, amplitude, phase, trigger):
+    segment = Segment()
+    segment.dds_lines(duration, amplitude, phase, trigger=trigger,
+                      clear=True)
+    return segment
+
+
+def main():
+    for order in range(4):
+        d, a, p, t = random_lines(1000, order, seed=order)
+        assert scalar_bias(d, a, t).data == bulk_bias(d, a, t).data, order
+    d, a, p, t = random_lines(1000, 3)
+    assert scalar_dds(d, a, p, t).data == bulk_dds(d, a, p, t).data
+
+    d, a, p, t = random_lines(20000, 3)
+    t0 = time.perf_counter()
+    scalar_bias(d, a, t)
+    t1 = time.perf_counter()
+    bulk_bias(d, a, t)
+    t2 = time.perf_counter()
+    print("bias: scalar {:.3g} s, bulk {:.3g} s, speedup {:.3g}".format(
+        t1 - t0, t2 - t1, (t1 - t0)/(t2 - t1)))
+
+
+if __name__ == "__main__":
+    main()
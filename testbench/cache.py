@@ -0,0 +1,135 @@
+# Copyright 2013-2015 Robert Jordens <jordens@gmail.com>
+#
+# This file is part of pdq2.
+#
+# pdq2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pdq2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pdq2.  If not, see <http://www.gnu.org/licenses/>.
+
+# Segment cache keys, hits and eviction
+
+from io import BytesIO
+import os
+import stat
+import tempfile
+
+from host.bench import synthetic_program
+from host.cache import DiskCache, SegmentCache, structural_key
+from host.pdq2 import Pdq2
+
+
+def check_segment_cache():
+    cache = SegmentCache(max_size=10)
+    assert cache.get("a") is None and cache.misses == 1
+    cache.put("a", b"1234")
+    cache.put("b", b"5678")
+    assert cache.get("a") == b"1234" and cache.hits == 1
+    # "b" is the least recently used entry
+    cache.put("c", b"90")
+    assert cache.size == 10 and len(cache) == 3
+    cache.put("d", b"x")
+    assert cache.get("b") is None and cache.evictions == 1
+    assert cache.get("a") == b"1234" and cache.get("c") == b"90"
+    # larger than the cache
+    cache.put("e", bytes(11))
+    assert cache.get("e") is None and cache.size == 7
+    cache.clear()
+    assert not len(cache) and not cache.size
+
+
+def check_keys():
+    line = {"duration": 10, "channel_data": [
+        {"bias": {"amplitude": [.1, .2]}},
+        {"dds": {"amplitude": [.1], "phase": [.3]}}]}
+    key = structural_key([line], 1)
+    hash(key)
+    assert key == structural_key([dict(line)], 1)
+    assert key != structural_key([line], 1, "param")
+    assert key != structural_key([line], 0)
+    for variant in [dict(line, trigger=True), dict(line, dac_divider=2),
+                    dict(line, duration=11),
+                    dict(line, channel_data=line["channel_data"][:1])]:
+        assert key != structural_key([variant], 1), variant
+    # the other channel is unaffected by a missing channel
+    assert structural_key([line], 0) == structural_key(
+        [dict(line, channel_data=line["channel_data"][:1])], 0)
+
+
+def check_program_cache():
+    program = synthetic_program(lines=20, frames=4, channels=3)
+    cache = SegmentCache()
+    p = Pdq2(dev=BytesIO(), num_boards=1, cache=cache)
+    p.program(program, range(3))
+    assert cache.hits == 0 and len(cache) == 12
+    images = [p.channels[i].serialize() for i in range(3)]
+    p.program(program, range(3))
+    assert cache.hits == 12
+    assert [p.channels[i].serialize() for i in range(3)] == images
+    # a changed frame misses on the changed channel only
+    program[1][0]["channel_data"][2]["bias"]["amplitude"][0] += .1
+    p.program(program, range(3))
+    assert cache.hits == 23 and cache.misses == 13
+
+
+def check_disk_cache(path):
+    # shared between instances (and processes)
+    a, b = DiskCache(path), DiskCache(path)
+    assert b.get("k") is None and b.misses == 1
+    a.put("k", b"data")
+    assert b.get("k") == b"data" and b.hits == 1
+    assert len(a) == len(b) == 1
+    a.clear()
+    assert a.get("k") is None
+
+    # least recently used entries are evicted, down to 3/4 of max_size
+    cache = DiskCache(path, max_size=350)
+    for i, key in enumerate("abc"):
+        cache.put(key, bytes(100))
+        os.utime(cache._file(key), (1000*(i + 1),)*2)
+    assert cache.get("a") is not None
+    cache.put("d", bytes(100))
+    assert cache.evictions == 2
+    assert [cache.get(key) is not None for key in "abcd"] == [
+        True, False, False, True]
+    assert cache.stats()["size"] == 200
+    # too large
+    cache.put("e", bytes(351))
+    assert cache.get("e") is None
+    cache.clear()
+
+
+def check_mode(path):
+    umask = os.umask(0o022)
+    try:
+        cache = DiskCache(path)
+        cache.put("k", b"data")
+        mode = stat.S_IMODE(os.stat(cache._file("k")).st_mode)
+        assert mode == 0o644, oct(mode)
+        # no temporary files are left
+        assert os.listdir(path) == ["k.bin"]
+    finally:
+        os.umask(umask)
+
+
+def main():
+    check_segment_cache()
+    check_keys()
+    check_program_cache()
+    with tempfile.TemporaryDirectory() as path:
+        check_disk_cache(path)
+    with tempfile.TemporaryDirectory() as path:
+        check_mode(path)
+    print("ok")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+# Copyright 2013-2015 Robert Jordens <jordens@gmail.com>
+#
+# This file is part of pdq2.
+#
+# pdq2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pdq2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pdq2.  If not, see <http://www.gnu.org/licenses/>.
+
+# The error bound of host.disasm against the output of host.synth
+
+from io import BytesIO
+from math import factorial
+
+import numpy as np
+
+from host import disasm, synth
+from host.pdq2 import Pdq2, Segment
+
+
+def random_frame(rng, lines=10):
+    frame = []
+    for j in range(lines):
+        duration = int(rng.randint(2, 3000))
+        order = rng.randint(4)
+        # each term stays within 1 V over the line: the output does not
+        # wrap
+        amplitude = rng.uniform(-1, 1, order + 1)
+        amplitude[1:] *= [factorial(k)/duration**k
+                          for k in range(1, order + 1)]
+        line = {"duration": duration,
+                "channel_data": [{"bias": {"amplitude": amplitude.tolist()}}]}
+        dac_divider = int(rng.choice([1, 2, 4]))
+        if dac_divider > 1:
+            line["dac_divider"] = dac_divider
+        frame.append(line)
+    return frame
+
+
+def main():
+    rng = np.random.RandomState(0)
+    worst = 0.
+    for i in range(20):
+        frame = random_frame(rng)
+        (channel, mem), = Pdq2(dev=BytesIO(), num_boards=1).compile(
+            [frame], [0])
+        table, lines = disasm.disassemble(mem)
+        bound, phase = disasm.error_bound(lines)
+        cycles = sum(line["duration"]*line.get("dac_divider", 1)
+                     for line in frame) + 100
+        t = synth.Timeline(np.frombuffer(mem, "<u2"), 0, cycles)
+        out = synth.synthesize(mem, 0, cycles)/Segment.out_scale
+        # the frame starts with a guard line
+        for line, start, b in zip(frame, t.stb[1:], bound[1:]):
+            amplitude = line["channel_data"][0]["bias"]["amplitude"]
+            x = np.arange(line["duration"])
+            ideal = sum(a*x**k/factorial(k) for k, a in enumerate(amplitude))
+            # two cycles of latency
+            o = out[start + 2 + x*line.get("dac_divider", 1)]
+            # the bound and the truncation to the DAC output
+            ratio = np.fabs(o - ideal).max()/(b + 1/Segment.out_scale)
+            assert ratio <= 1, (line, ratio)
+            worst = max(worst, ratio)
+    print("worst error/bound: {:.3g}".format(worst))
+
+
+if __name__ == "__main__":
+    main()
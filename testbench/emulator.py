@@ -0,0 +1,200 @@
+# Copyright 2013-2015 Robert Jordens <jordens@gmail.com>
+#
+# This file is part of pdq2.
+#
+# pdq2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pdq2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pdq2.  If not, see <http://www.gnu.org/licenses/>.
+
+# Protocol level tests of host.pdq2 against host.emulator
+
+import time
+
+import numpy as np
+
+from host import disasm
+from host.bench import synthetic_program
+from host.emulator import Emulator
+from host.pdq2 import AllocationError, Pdq2
+from host.stats import UploadStats
+
+
+class Recorder:
+    def __init__(self, dev):
+        self.dev = dev
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return self.dev.write(data)
+
+
+def check_program(rng):
+    emu = Emulator()
+    dev = Recorder(emu)
+    p = Pdq2(dev=dev, num_boards=3)
+    p.cmd("RESET", True)
+    p.cmd("START", False)
+    p.cmd("ARM", True)
+    channels = sorted(rng.choice(9, 3, replace=False).tolist())
+    program = synthetic_program(lines=20, frames=4, channels=3,
+                                seed=rng.randint(1 << 16))
+    p.program(program, channels)
+    p.cmd("START", True)
+    for channel in channels:
+        image = np.frombuffer(p.channels[channel].serialize(), "<u2")
+        assert np.all(emu.memory(channel)[:len(image)] == image), channel
+    for board in emu.boards:
+        assert board.arm and board.start and not board.dcm_sel
+        assert board.resets == 1
+    assert emu.state == "DEV"
+
+    # the disassembler agrees
+    stream = b"".join(dev.chunks)
+    words, commands, writes = disasm.parse(stream)
+    for channel, mem in disasm.memories(words, writes).items():
+        assert np.all(emu.memory(channel)[:len(mem)] == mem), channel
+
+    # the stream can be split anywhere, also within escape sequences
+    split = Emulator()
+    cuts = np.sort(rng.randint(0, len(stream), 500))
+    for a, b in zip(np.r_[0, cuts], np.r_[cuts, len(stream)]):
+        split.write(stream[a:b])
+    assert split.commands == emu.commands
+    for channel in range(9):
+        assert np.all(split.memory(channel) == emu.memory(channel))
+
+
+def check_addressing():
+    emu = Emulator(num_boards=2)
+    p = Pdq2(dev=emu, num_boards=4)
+    data = bytes([0xa5, 0xa5, 1, 0xa5, 2, 3])
+    p.write_mem(4, data, start_addr=(1 << 13) - 1)
+    assert emu.boards[1].mems[1][-1] == 0xa5a5
+    assert emu.boards[1].mems[1][:2].tolist() == [0xa501, 0x0302]
+    # writes to absent boards are ignored
+    p.write_mem(9, data)
+    assert not any(np.any(mem[:3]) for mem in emu.boards[0].mems)
+    assert emu.state == "DEV"
+
+
+class Flaky:
+    def __init__(self, dev):
+        self.dev = dev
+        self.fail = False
+
+    def write(self, data):
+        if self.fail:
+            raise OSError("write failed")
+        return self.dev.write(data)
+
+
+def check_failed_write():
+    emu = Emulator()
+    dev = Flaky(emu)
+    p = Pdq2(dev=dev, num_boards=1, differential=True)
+    p.program(synthetic_program(frames=2, lines=5, channels=1), [0])
+    program = synthetic_program(frames=2, lines=5, channels=1, seed=1)
+    dev.fail = True
+    try:
+        p.program(program, [0])
+    except OSError:
+        pass
+    # the shadow copy does not claim data that was not written
+    assert p.shadow[0] is None
+    dev.fail = False
+    p.program(program, [0])
+    image = np.frombuffer(p.channels[0].serialize(), "<u2")
+    assert np.all(emu.memory(0)[:len(image)] == image)
+    assert p.shadow[0] == image.tobytes()
+
+
+def check_failed_update():
+    emu = Emulator()
+    p = Pdq2(dev=emu, num_boards=1)
+    p.program(synthetic_program(frames=4, lines=40, channels=2), [0, 1])
+    written = emu.bytes_written
+    memory = [emu.memory(i).copy() for i in range(2)]
+    stats = [p.channels[i].stats() for i in range(2)]
+    images = [p.channels[i].serialize() for i in range(2)]
+    # fits on the first channel but not on the second
+    frame = [{"duration": 10, "channel_data": [
+        {"bias": {"amplitude": [.1]}},
+        {"dds": {"amplitude": [.1, 0, 0, 0], "phase": [.1, 0, 0]}},
+    ]}] * 300
+    try:
+        p.update_frame(1, frame, [0, 1])
+    except AllocationError:
+        pass
+    else:
+        assert False
+    assert emu.bytes_written == written
+    for i in range(2):
+        assert np.all(emu.memory(i) == memory[i])
+        # before serialize(), which re-places all segments
+        assert p.channels[i].stats() == stats[i]
+        assert p.channels[i].serialize() == images[i]
+    # the channels are still usable
+    frame = synthetic_program(frames=1, lines=5, channels=2, seed=1)[0]
+    p.update_frame(1, frame, [0, 1])
+    for i in range(2):
+        ch = p.channels[i]
+        table = np.frombuffer(ch.table(ch.entry), "<u2")
+        assert np.all(emu.memory(i)[:len(table)] == table)
+        assert emu.memory(i)[table[0]] == memory[i][table[0]]
+
+
+def check_stats():
+    emu = Emulator()
+    sizes = []
+    stats = UploadStats(callback=lambda size, duration: sizes.append(size))
+    p = Pdq2(dev=emu, num_boards=3, stats=stats)
+    p.cmd("ARM", True)
+    data = bytes([0xa5, 0xa5, 1, 0xa5, 2, 3])
+    p.write_mem(0, data)
+    p.program(synthetic_program(lines=20, frames=4, channels=3), [0, 4, 8],
+              pipeline=True)
+    s = stats.as_dict()
+    assert s["bytes_written"] == emu.bytes_written == sum(sizes)
+    assert s["write_calls"] == len(sizes)
+    assert s["commands"] == 1 and s["mem_writes"] == sum(s["latency"]) == 4
+    assert s["escape_bytes"] >= data.count(0xa5)
+    assert (s["payload_bytes"] + s["escape_bytes"] + 2*s["commands"] ==
+            s["bytes_written"])
+
+
+def benchmark():
+    emu = Emulator()
+    p = Pdq2(dev=emu, num_boards=3)
+    image = np.random.RandomState(0).randint(
+        0, 1 << 16, p.channels[0].max_data).astype("<u2").tobytes()
+    t0 = time.perf_counter()
+    for i in range(10):
+        for channel in range(9):
+            p.write_mem(channel, image)
+    t = time.perf_counter() - t0
+    print("upload: {:.3g} MB/s".format(emu.bytes_written/t/1e6))
+
+
+def main():
+    rng = np.random.RandomState(0)
+    for i in range(20):
+        check_program(rng)
+    check_addressing()
+    check_failed_write()
+    check_failed_update()
+    check_stats()
+    benchmark()
+
+
+if __name__ == "__main__":
+    main()
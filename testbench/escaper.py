@@ -0,0 +1,60 @@
+# Copyright 2013-2015 Robert Jordens <jordens@gmail.com>
+#
+# This file is part of pdq2.
+#
+# pdq2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pdq2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pdq2.  If not, see <http://www.gnu.org/licenses/>.
+
+# The chunked host.escape.Escaper against bytes.replace()
+
+import numpy as np
+
+from host.escape import Escaper, unescape
+
+
+def check(escaper, data):
+    expect = data.replace(b"\xa5", b"\xa5\xa5")
+    chunks = [bytes(chunk) for chunk in escaper.encode(data)]
+    assert b"".join(chunks) == expect
+    assert escaper(data) == expect
+    assert escaper.size(data) == len(expect)
+    out, commands = unescape(expect)
+    assert out.tobytes() == data and not len(commands)
+    return chunks
+
+
+def main():
+    escaper = Escaper(chunk_size=4)
+    # the first chunk ends in an escape character, the second starts
+    # with one, the third has none and the last is short
+    chunks = check(escaper, b"\x01\x02\x03\xa5\xa5\x04\xa5\xa5"
+                   b"\x05\x06\x07\x08\xa5")
+    assert chunks == [b"\x01\x02\x03\xa5\xa5", b"\xa5\xa5\x04\xa5\xa5\xa5\xa5",
+                      b"\x05\x06\x07\x08", b"\xa5\xa5"]
+    for data in b"", b"\xa5", b"\xa5"*9, bytes(9):
+        check(escaper, data)
+
+    rng = np.random.RandomState(0)
+    for chunk_size in 1, 2, 3, 7, 64:
+        escaper = Escaper(chunk_size=chunk_size)
+        for i in range(20):
+            # many escape characters
+            data = rng.choice([0, 0xa5], rng.randint(200)).astype(np.uint8)
+            check(escaper, data.tobytes())
+            data = rng.randint(0, 256, rng.randint(200)).astype(np.uint8)
+            check(escaper, data.tobytes())
+    print("ok")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+# Copyright 2013-2015 Robert Jordens <jordens@gmail.com>
+#
+# This file is part of pdq2.
+#
+# pdq2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pdq2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pdq2.  If not, see <http://www.gnu.org/licenses/>.
+
+# Spline fits of host.fit against scipy.interpolate and host.synth
+
+from io import BytesIO
+
+import numpy as np
+from scipy import interpolate
+
+from host import synth
+from host.fit import fit, fit_adaptive
+from host.pdq2 import Pdq2, Segment
+
+
+def samples(rng, n=50, channels=3):
+    times = np.cumsum(rng.randint(20, 2000, n))
+    times -= times[0]
+    voltages = rng.uniform(-1, 1, (channels, 1))*np.sin(
+        times/rng.uniform(1e3, 1e4, (channels, 1)))
+    return times, voltages
+
+
+def splrep_frame(times, voltages, order):
+    # the interpolation of host.cli before host.fit
+    frame = [{"duration": int(dt), "channel_data": []}
+             for dt in np.diff(times)]
+    for v in voltages:
+        if order:
+            tck = interpolate.splrep(times, v, k=order, s=0)
+            u = interpolate.spalde(times, tck)
+        else:
+            u = v[:, None]
+        for line, ui in zip(frame, u):
+            line["channel_data"].append(
+                {"bias": {"amplitude": [float(uij) for uij in ui]}})
+    return frame
+
+
+def compile_frame(frame, channels):
+    p = Pdq2(dev=BytesIO(), num_boards=1)
+    return p.compile([frame], range(channels))
+
+
+def raises(func, *args):
+    try:
+        func(*args)
+    except ValueError:
+        return True
+    return False
+
+
+def check_fit(rng):
+    for order in range(4):
+        times, voltages = samples(rng)
+        frame = fit(times, voltages, order)
+        assert frame.shape == (3, len(times) - 1)
+        assert (compile_frame(frame, 3) ==
+                compile_frame(splrep_frame(times, voltages, order), 3)), order
+    times, voltages = samples(rng)
+    times[10:] += 1 << 16
+    assert raises(fit, times, voltages)
+    times, voltages = samples(rng)
+    times[10] = times[9]
+    assert raises(fit, times, voltages)
+
+
+def check_adaptive(rng):
+    for order in range(4):
+        times, voltages = samples(rng)
+        tolerance = rng.choice([1e-2, 3e-3, 1e-3])
+        frame, stats = fit_adaptive(times, voltages, tolerance, order)
+        for (channel, mem), v, s in zip(compile_frame(frame, 3), voltages,
+                                        stats):
+            assert s["lines"] <= len(times) - 1
+            t = synth.Timeline(np.frombuffer(mem, "<u2"), 0, times[-1])
+            out = synth.synthesize(mem, 0, times[-1] + 10)
+            # the first line after the guard line, two cycles of latency
+            out = out[t.stb[1] + 2 + times[:-1]]/Segment.out_scale
+            error = np.fabs(out - v[:-1]).max()
+            assert error == s["error"] <= tolerance, (error, s, tolerance)
+    times, voltages = samples(rng)
+    times[10:] += 1 << 16
+    assert raises(fit_adaptive, times, voltages, 1e-3)
+
+
+def main():
+    rng = np.random.RandomState(0)
+    check_fit(rng)
+    check_adaptive(rng)
+    print("ok")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+# Copyright 2013-2015 Robert Jordens <jordens@gmail.com>
+#
+# This file is part of pdq2.
+#
+# pdq2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pdq2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pdq2.  If not, see <http://www.gnu.org/licenses/>.
+
+# Stack images of host.image and their upload with host.pdq2
+
+from io import BytesIO
+import os
+import stat
+import tempfile
+
+from host import image
+from host.bench import synthetic_program
+from host.pdq2 import Pdq2
+
+
+def raises(func, *args):
+    try:
+        func(*args)
+    except ValueError:
+        return True
+    return False
+
+
+def check_pack():
+    images = [(4, bytes(range(10))), (0, b""), (7, b"\xa5\x5a")]
+    data = image.pack_image(images, 3, num_frames=1, key="ab"*20)
+    img = image.StackImage(data)
+    assert (img.version, img.num_boards, img.num_dacs, img.num_frames) == (
+        image.VERSION, 3, 3, 1)
+    assert img.key == "ab"*20 and img.channels == [4, 0, 7]
+    for channel, expect in images:
+        assert img.image(channel) == expect
+    assert img.table(4).tolist() == [0x100]
+    assert img.verify()
+    assert image.StackImage(image.pack_image(images, 3)).key is None
+
+    corrupt = bytearray(data)
+    corrupt[-1] ^= 1
+    assert not image.StackImage(corrupt).verify()
+    assert raises(image.StackImage, data[:40])
+    assert raises(image.StackImage, data[:-1])
+    assert raises(image.StackImage, b"X" + data[1:])
+    corrupt = bytearray(data)
+    corrupt[8] += 1
+    assert raises(image.StackImage, corrupt)
+
+
+def check_load():
+    program = synthetic_program(lines=20, frames=4, channels=6)
+    channels = [0, 2, 3, 5, 7, 8]
+    buf = BytesIO()
+    p = Pdq2(dev=buf, num_boards=3)
+    p.program(program, channels)
+    expect = buf.getvalue()
+
+    data = image.compile_image(Pdq2(dev=BytesIO(), num_boards=3), program,
+                               channels)
+    img = image.StackImage(data)
+    assert img.channels == channels and img.key
+    for channel in channels:
+        assert img.image(channel) == p.channels[channel].serialize()
+
+    buf = BytesIO()
+    q = Pdq2(dev=buf, num_boards=3)
+    q.load_image(img)
+    assert buf.getvalue() == expect
+    for channel in channels:
+        assert q.channels[channel].serialize() == \
+            p.channels[channel].serialize()
+    # the loaded frames can be updated
+    frame = synthetic_program(lines=5, frames=1, channels=6, seed=1)[0]
+    p.update_frame(1, frame, channels)
+    q.update_frame(1, frame, channels)
+    for channel in channels:
+        assert q.channels[channel].serialize() == \
+            p.channels[channel].serialize()
+
+    assert raises(Pdq2(dev=BytesIO(), num_boards=2).load_image, img)
+    corrupt = bytearray(data)
+    corrupt[-1] ^= 1
+    buf = BytesIO()
+    assert raises(Pdq2(dev=buf, num_boards=3).load_image,
+                  image.StackImage(corrupt))
+    assert not buf.getvalue()
+
+
+def check_file(path):
+    data = image.compile_image(Pdq2(dev=BytesIO(), num_boards=1),
+                               synthetic_program(frames=2), range(3))
+    name = os.path.join(path, "stack.img")
+    umask = os.umask(0o022)
+    try:
+        image.save(name, data)
+    finally:
+        os.umask(umask)
+    assert stat.S_IMODE(os.stat(name).st_mode) == 0o644
+    assert os.listdir(path) == ["stack.img"]
+    with image.StackImage.open(name) as img:
+        assert img.verify()
+        assert img.table(1).tolist() == \
+            image.StackImage(data).table(1).tolist()
+
+
+def main():
+    check_pack()
+    check_load()
+    with tempfile.TemporaryDirectory() as path:
+        check_file(path)
+    print("ok")
+
+
+if __name__ == "__main__":
+    main()
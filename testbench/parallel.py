@@ -0,0 +1,87 @@
+# Copyright 2013-2015 Robert Jordens <jordens@gmail.com>
+#
+# This file is part of pdq2.
+#
+# pdq2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pdq2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pdq2.  If not, see <http://www.gnu.org/licenses/>.
+
+# Parallel compilation with host.parallel is identical to serial compilation
+
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+import numpy as np
+
+from host.bench import synthetic_program
+from host.pdq2 import Pdq2
+from host.wavesynth import from_dicts
+
+
+def random_program(rng, channels=9):
+    program = []
+    for i in range(4):
+        frame = []
+        for target in "bias", "dds":
+            frame += synthetic_program(
+                lines=10, frames=1, channels=channels,
+                order=rng.randint(4), target=target,
+                seed=rng.randint(1 << 16))[0]
+        rng.shuffle(frame)
+        program.append(frame)
+    return program
+
+
+def compile_program(program, channels, executor=None):
+    buf = BytesIO()
+    p = Pdq2(dev=buf, num_boards=3)
+    p.program(program, channels, executor=executor)
+    return buf.getvalue(), [p.channels[i].serialize() for i in channels]
+
+
+class Broken:
+    def submit(self, *args):
+        raise RuntimeError("cannot schedule new futures after shutdown")
+
+
+def main():
+    rng = np.random.RandomState(0)
+    with ProcessPoolExecutor(3) as executor:
+        for i in range(3):
+            program = random_program(rng)
+            channels = rng.permutation(9)[:rng.randint(1, 10)].tolist()
+            expect = compile_program(program, channels)
+            got = compile_program(program, channels, executor)
+            assert got == expect, channels
+            # columnar frames
+            columnar = from_dicts(program)
+            assert compile_program(columnar, channels, executor) == expect
+
+        # unpicklable programs are compiled serially
+        class Amplitude(list):
+            pass
+
+        program = random_program(rng)
+        channels = list(range(9))
+        expect = compile_program(program, channels)
+        assert compile_program(program, channels, Broken()) == expect
+        for line in program[0]:
+            for data in line["channel_data"]:
+                for target_data in data.values():
+                    target_data["amplitude"] = Amplitude(
+                        target_data["amplitude"])
+        assert compile_program(program, channels, executor) == expect
+    print("ok")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+# Copyright 2013-2015 Robert Jordens <jordens@gmail.com>
+#
+# This file is part of pdq2.
+#
+# pdq2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pdq2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pdq2.  If not, see <http://www.gnu.org/licenses/>.
+
+# Splitting of long lines and shift selection of host.pdq2.split_line
+
+from io import BytesIO
+from math import factorial
+
+import numpy as np
+
+from host import synth
+from host.pdq2 import Pdq2, Segment, split_line
+from host.wavesynth import from_dicts
+
+
+def check_lines(duration, amplitude, dac_divider=1):
+    lines = split_line(duration, amplitude, [], dac_divider)
+    cycles = [steps << shift for steps, shift, a, p in lines]
+    assert sum(cycles) == duration*dac_divider
+    assert all(0 < steps < 1 << 16 and 0 <= shift < 16
+               for steps, shift, a, p in lines)
+    assert cycles[-1] >= 18
+    return lines
+
+
+def check_holds():
+    for duration in 1 << 16, 123456, 1 << 24, (1 << 31) - 7, 1 << 31:
+        lines = check_lines(duration, [.5])
+        assert len(lines) <= 2, (duration, lines)
+        assert all(a == [.5] for steps, shift, a, p in lines)
+    # the shift of a power-of-two divider is a lower bound
+    lines = check_lines(100, [.5], 1 << 15)
+    assert lines == [(100, 15, [.5], [])]
+    # other dividers are evaluated on every clock cycle
+    lines = check_lines(1000, [.5, 1e-3], 3)
+    assert [shift for steps, shift, a, p in lines] == [0]
+
+
+def synthesize(line):
+    (channel, mem), = Pdq2(dev=BytesIO(), num_boards=1).compile(
+        [[line]], [0])
+    cycles = line["duration"]*line.get("dac_divider", 1)
+    t = synth.Timeline(np.frombuffer(mem, "<u2"), 0, cycles + 100)
+    out = synth.synthesize(mem, 0, cycles + 100)
+    # the first line after the guard line, two cycles of latency
+    return out[t.stb[1] + 2:][:cycles]/Segment.out_scale
+
+
+def check_splines():
+    t = 1 << 20
+    for amplitude, dac_divider in [
+            ([-1., 2/t], 1),  # ramp
+            ([-1., 2/t*8], 8),
+            ([-1., 2/t*3], 3),
+            ([0., 0., 0., 6/t**3], 1),  # cubic
+            ([.5, -3/t, 6/t**2, -6/t**3], 1)]:
+        line = {"duration": t//dac_divider,
+                "channel_data": [{"bias": {"amplitude": amplitude}}]}
+        if dac_divider > 1:
+            line["dac_divider"] = dac_divider
+        lines = check_lines(line["duration"], amplitude, dac_divider)
+        # shallow enough for coarser steps, the remainder at the base shift
+        assert lines[0][1] > 3
+        out = synthesize(line)
+        x = np.arange(len(out))/dac_divider
+        ideal = sum(a*x**k/factorial(k) for k, a in enumerate(amplitude))
+        error = np.fabs(out - ideal).max()*Segment.out_scale
+        # one LSB of stepping and one of rounding
+        assert error < 2, (amplitude, dac_divider, error)
+
+
+def raises(func, *args):
+    try:
+        func(*args)
+    except ValueError:
+        return True
+    return False
+
+
+def check_dividers():
+    line = {"duration": 10, "channel_data": [{"bias": {"amplitude": [.1]}}]}
+    for dac_divider in 0, -2, 2.5, 1 << 16, 1 << 20:
+        bad = dict(line, dac_divider=dac_divider)
+        assert raises(split_line, 1 << 20, [.5], [], dac_divider)
+        assert raises(Pdq2(dev=BytesIO(), num_boards=1).compile, [[bad]],
+                      [0])
+        assert raises(from_dicts, [[bad]])
+    # not a power of two: split at shift 0
+    assert check_lines(1 << 20, [.5], (1 << 16) + 1)
+    assert split_line(10, [.5], [], 4.) == split_line(10, [.5], [], 4)
+
+
+def main():
+    check_holds()
+    check_splines()
+    check_dividers()
+    print("ok")
+
+
+if __name__ == "__main__":
+    main()
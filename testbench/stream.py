@@ -0,0 +1,67 @@
+#!/usr/bin/python3
+# Copyright 2013-2015 Robert Jordens <jordens@gmail.com>
+#
+# This file is part of pdq2.
+#
+# pdq2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pdq2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pdq2.  If not, see <http://www.gnu.org/licenses/>.
+
+import resource
+import subprocess
+import sys
+import time
+
+from host.pdq2 import Pdq2, Segment
+
+
+class Sink:
+    def write(self, data):
+        pass
+
+
+def lines(n, num_channels):
+    for i in range(n):
+        yield {
+            "duration": 100,
+            "channel_data": [{
+                "bias": {"amplitude": [1e-4*(i % 1000), 1e-5, 1e-7, -1e-9]}
+            } for j in range(num_channels)]
+        }
+
+
+def run(mode, n=100000):
+    # the compiled lines exceed the channel memory: compile only
+    frame = lines(n, 3)
+    if mode == "list":
+        frame = list(frame)
+    segments = [Segment() for i in range(3)]
+    t0 = time.perf_counter()
+    Pdq2(dev=Sink(), num_boards=1).program_frame(segments, frame)
+    t1 = time.perf_counter()
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print("{}: {} lines, {:.3g} s, peak RSS {:.1f} MiB".format(
+        mode, n, t1 - t0, rss/1024))
+
+
+def main():
+    if len(sys.argv) > 1:
+        run(sys.argv[1])
+        return
+    for mode in "list", "generator":
+        # separate processes for independent peak RSS values
+        subprocess.check_call([sys.executable, "-m", "testbench.stream",
+                               mode])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+# Copyright 2013-2015 Robert Jordens <jordens@gmail.com>
+#
+# This file is part of pdq2.
+#
+# pdq2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pdq2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pdq2.  If not, see <http://www.gnu.org/licenses/>.
+
+# Cross-check of host.synth against the Migen simulation of gateware.dac.Dac
+
+from io import BytesIO
+import time
+
+from migen.fhdl.std import *
+from migen.sim.generic import run_simulation
+
+import numpy as np
+
+from gateware.dac import Dac
+from host import pdq2, synth
+
+
+class TB(Module):
+    def __init__(self, mem, frame, trigger):
+        self.submodules.dac = Dac()
+        self.dac.parser.mem.init = mem
+        self.dac.parser.frame.reset = frame
+        self.dac.parser.start.reset = 1
+        self.dac.parser.arm.reset = 1
+        self.dac.out.arm.reset = 1
+        self.trigger = trigger
+        self.outputs = []
+
+    def do_simulation(self, selfp):
+        cycle = len(self.outputs)
+        selfp.dac.out.trigger = int(self.trigger[cycle])
+        self.outputs.append(selfp.dac.out.data)
+
+
+def random_program(rng, frames=2, lines=5):
+    program = []
+    for i in range(frames):
+        frame = []
+        for j in range(lines):
+            order = rng.randint(4)
+            amplitude = rng.uniform(-1, 1, 4)*10.**-(2*np.arange(4))
+            if rng.randint(2):
+                data = {"bias": {"amplitude": amplitude[:order + 1].tolist()}}
+            else:
+                phase = rng.uniform(-.5, .5, 3)*10.**-(2*np.arange(3))
+                data = {"dds": {"amplitude": amplitude.tolist(),
+                                "phase": phase[:order].tolist(),
+                                "clear": bool(rng.randint(2))}}
+            line = {"duration": int(rng.randint(1, 200)),
+                    "trigger": bool(rng.randint(2)),
+                    "channel_data": [data]}
+            # dividers that are not powers of two are split and may get
+            # a coarser shift (see host.pdq2.split_line)
+            dac_divider = int(rng.choice([1, 1, 2, 4, 8, 16, 3, 6]))
+            if dac_divider > 1:
+                line["dac_divider"] = dac_divider
+            frame.append(line)
+        program.append(frame)
+    return program
+
+
+def main():
+    rng = np.random.RandomState(0)
+    cycles = 4000
+    for i in range(10):
+        program = random_program(rng)
+        p = pdq2.Pdq2(dev=BytesIO(), num_boards=1)
+        p.program(program, [0])
+        mem = p.channels[0].serialize()
+        frame = rng.randint(len(program))
+        trigger = rng.rand(cycles + 1) < .1
+
+        tb = TB(list(np.frombuffer(mem, "<u2")), frame, trigger)
+        t0 = time.perf_counter()
+        run_simulation(tb, ncycles=cycles)
+        t_sim = time.perf_counter() - t0
+        sim = np.array(tb.outputs[:cycles], np.uint16).view(np.int16)
+
+        t0 = time.perf_counter()
+        out = synth.synthesize(mem, frame, cycles, trigger)
+        t_synth = time.perf_counter() - t0
+
+        bad = np.flatnonzero(sim != out)
+        print("program {}: {} mismatches, migen {:.3g} s, "
+              "synth {:.3g} s ({:.3g}x)".format(
+                  i, len(bad), t_sim, t_synth, t_sim/t_synth))
+        assert not len(bad), (bad[0], sim[bad[0]], out[bad[0]])
+
+
+if __name__ == "__main__":
+    main()
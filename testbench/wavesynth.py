@@ -0,0 +1,112 @@
+# Copyright 2013-2015 Robert Jordens <jordens@gmail.com>
+#
+# This file is part of pdq2.
+#
+# pdq2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pdq2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pdq2.  If not, see <http://www.gnu.org/licenses/>.
+
+# Columnar and dictionary wavesynth programs convert losslessly and compile
+# to the same channel memories
+
+from io import BytesIO
+
+import numpy as np
+
+from host.pdq2 import Pdq2
+from host.wavesynth import from_dicts, to_dicts
+
+
+def random_program(rng, frames=3, lines=20, channels=3, short=False):
+    program = []
+    for i in range(frames):
+        frame = []
+        for j in range(lines):
+            n = rng.randint(1, channels + 1) if short else channels
+            channel_data = []
+            for k in range(n):
+                dds = rng.randint(2)
+                order = 3 if dds else rng.randint(-1, 4)
+                amplitude = rng.uniform(-1, 1, order + 1)
+                amplitude *= 10.**-(4*np.arange(order + 1))
+                data = {}
+                if order >= 0:
+                    data["amplitude"] = amplitude.tolist()
+                if rng.randint(2):
+                    data["silence"] = True
+                if dds:
+                    data["phase"] = rng.uniform(
+                        0, .5, rng.randint(1, 4)).tolist()
+                    if rng.randint(2):
+                        data["clear"] = True
+                    channel_data.append({"dds": data})
+                else:
+                    channel_data.append({"bias": data})
+            line = {"duration": int(rng.randint(1, 1000)),
+                    "channel_data": channel_data}
+            if rng.randint(2):
+                line["trigger"] = True
+            if rng.randint(2):
+                line["dac_divider"] = 1 << rng.randint(1, 4)
+            frame.append(line)
+        program.append(frame)
+    return program
+
+
+def compile_program(program, channels):
+    buf = BytesIO()
+    Pdq2(dev=buf, num_boards=1).program(program, channels)
+    return buf.getvalue()
+
+
+def check_dividers(rng):
+    program = random_program(rng)
+    floats = [[dict(line, dac_divider=float(line.get("dac_divider", 1)))
+               for line in frame] for frame in program]
+    # long lines are split on the dictionary path
+    for frame in program, floats:
+        frame[0][0].update(duration=1 << 17, channel_data=[
+            {"bias": {"amplitude": [.5]}}] * 3)
+    assert (compile_program(floats, range(3)) ==
+            compile_program(program, range(3)))
+    try:
+        from_dicts(program)
+    except ValueError:
+        pass
+    else:
+        assert False
+    floats[0][0]["dac_divider"] = 2.5
+    try:
+        compile_program(floats, range(3))
+    except ValueError:
+        pass
+    else:
+        assert False
+
+
+def main():
+    rng = np.random.RandomState(0)
+    check_dividers(rng)
+    for i in range(20):
+        program = random_program(rng)
+        assert to_dicts(from_dicts(program)) == program
+        assert (compile_program(from_dicts(program), range(3)) ==
+                compile_program(program, range(3)))
+
+        program = random_program(rng, short=True)
+        assert (compile_program(from_dicts(program, 3), range(3)) ==
+                compile_program(program, range(3)))
+    print("ok")
+
+
+if __name__ == "__main__":
+    main()